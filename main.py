@@ -13,7 +13,7 @@ import logging
 from src.pdf_processor import PDFProcessor
 from src.llm_client import LLMClient
 from src.qa_generator import QAGenerator
-from src.excel_writer import ExcelWriter
+from src.excel_writer import ExcelWriter, JSONL_FILENAME
 from dotenv import load_dotenv
 
 # 配置日志
@@ -53,8 +53,29 @@ def parse_arguments():
     parser.add_argument('--use_latex_ocr', action='store_true', default=True,
                         help='启用LaTeX公式OCR识别 (默认: 启用)')
 
+    parser.add_argument('--latex_cache_dir', type=str, default='./cache/latex',
+                        help='LaTeX公式识别结果缓存目录 (默认: ./cache/latex)')
+
+    parser.add_argument('--formula_zoom', type=float, default=2.0,
+                        help='公式区域渲染缩放倍数，1.5通常不损失识别精度且更快 (默认: 2.0)')
+
+    parser.add_argument('--formula_batch_size', type=int, default=8,
+                        help='公式OCR单次批量推理的最大图像数 (默认: 8)')
+
     parser.add_argument('--answer_workers', type=int, default=15,
-                        help='答案生成的并行线程数 (默认: 10)')
+                        help='答案生成的最大并发请求数 (默认: 15)')
+
+    parser.add_argument('--answer_batch_size', type=int, default=1,
+                        help='pro模式下单次请求生成答案的问题数，大于1时同一文档内容只发送一次 (默认: 1)')
+
+    parser.add_argument('--answer_cache_dir', type=str, default=None,
+                        help='答案缓存目录，重复运行时相同提示词直接复用已生成的答案 (默认: 不缓存)')
+
+    parser.add_argument('--semantic_cache', action='store_true',
+                        help='启用答案的语义相似匹配缓存（需安装sentence-transformers和faiss）')
+
+    parser.add_argument('--answer_context_chunks', type=int, default=0,
+                        help='pro模式下长文档按约3000字分块，每个问题只检索该数量的相关块作为答案上下文（需安装scikit-learn） (默认: 0，使用完整文档)')
 
     parser.add_argument('--model', type=str, default=None,
                         help='指定LLM模型 (默认: 使用.env中的MODEL_NAME或llm-chat)')
@@ -68,6 +89,12 @@ def parse_arguments():
     parser.add_argument('--txt_dir', type=str, default='./txt_dir',
                         help='txt文件目录 (默认: ./txt_dir)')
 
+    parser.add_argument('--jsonl_output', action='store_true', default=False,
+                        help='所有结果追加写入输出目录下各模式的results.jsonl，而不是每个PDF单独一个JSON文件')
+
+    parser.add_argument('--split_jsonl', action='store_true', default=False,
+                        help='仅把指定模式的results.jsonl拆分为每个PDF单独的JSON文件，不生成问答对')
+
     parser.add_argument('--mode', type=str, default='normal', choices=['normal', 'pro'], 
                         help='模式: normal-正常模式生成大量较短的且相对常见基础的知识问答对, pro-专业模式生成少量但长篇的深入研讨问答对')
 
@@ -94,6 +121,12 @@ def main():
 
     try:
         # 根据参数选择执行模式
+        if args.split_jsonl:
+            # 拆分模式：把JSONL结果拆分为每个PDF单独的JSON文件（供stat.py、post_process.py使用）
+            count = ExcelWriter(output_dir=args.output_dir).split_jsonl_to_files(args.mode)
+            print(f"已生成 {count} 个JSON文件")
+            return
+
         if args.extract_only:
             # 仅识别模式：提取PDF内容并保存为txt文件
             logger.info("开始执行PDF文本提取模式")
@@ -105,11 +138,13 @@ def main():
                 return
             
             # 初始化PDF处理器并执行提取
-            pdf_processor = PDFProcessor(args.pdf_dir, args.use_latex_ocr)
-            pdf_processor.extract_pdfs_to_txt(
-                txt_dir=args.txt_dir,
-                max_workers=args.max_workers
-            )
+            with PDFProcessor(
+                    args.pdf_dir, args.use_latex_ocr, args.latex_cache_dir, args.formula_zoom,
+                    args.formula_batch_size) as pdf_processor:
+                pdf_processor.extract_pdfs_to_txt(
+                    txt_dir=args.txt_dir,
+                    max_workers=args.max_workers
+                )
             return
         
         elif args.from_txt:
@@ -122,24 +157,29 @@ def main():
                 print(f"错误: txt目录不存在: {args.txt_dir}")
                 return
             
-            # 初始化Excel写入器
-            excel_writer = ExcelWriter(output_dir=args.output_dir)
-            
-            # 初始化问答生成器（传入excel_writer，用于每个txt处理完后立即保存）
-            qa_generator = QAGenerator(
-                pdf_dir=args.pdf_dir,  # 这个参数在从txt模式中不会被使用，但需要传入
-                num_qa_pairs=args.num_qa,
-                max_workers=args.max_workers,
-                api_max_retries=args.api_retries,
-                api_retry_delay=args.retry_delay,
-                use_latex_ocr=args.use_latex_ocr,
-                answer_max_workers=args.answer_workers,
-                excel_writer=excel_writer,
-                mode=args.mode
-            )
-            
-            # 从txt文件生成问答对
-            qa_results, failed_files = qa_generator.generate_qa_from_txt_files(args.txt_dir)
+            # 初始化Excel写入器和问答生成器（传入excel_writer，用于每个txt处理完后立即保存），
+            # 退出with块时（包括出错时）关闭生成器并同步输出文件
+            with ExcelWriter(output_dir=args.output_dir, jsonl=args.jsonl_output) as excel_writer, \
+                    QAGenerator(
+                        pdf_dir=args.pdf_dir,  # 这个参数在从txt模式中不会被使用，但需要传入
+                        num_qa_pairs=args.num_qa,
+                        max_workers=args.max_workers,
+                        api_max_retries=args.api_retries,
+                        api_retry_delay=args.retry_delay,
+                        use_latex_ocr=args.use_latex_ocr,
+                        answer_max_workers=args.answer_workers,
+                        excel_writer=excel_writer,
+                        mode=args.mode,
+                        latex_cache_dir=args.latex_cache_dir,
+                        formula_zoom=args.formula_zoom,
+                        formula_batch_size=args.formula_batch_size,
+                        answer_batch_size=args.answer_batch_size,
+                        answer_cache_dir=args.answer_cache_dir,
+                        semantic_cache=args.semantic_cache,
+                        answer_context_chunks=args.answer_context_chunks
+                    ) as qa_generator:
+                # 从txt文件生成问答对
+                qa_results, failed_files = qa_generator.generate_qa_from_txt_files(args.txt_dir)
             
         else:
             # 默认模式：从PDF生成问答对
@@ -151,24 +191,29 @@ def main():
                 print(f"错误: PDF目录不存在: {args.pdf_dir}")
                 return
 
-            # 初始化Excel写入器
-            excel_writer = ExcelWriter(output_dir=args.output_dir)
-
-            # 初始化问答生成器（传入excel_writer，用于每个PDF处理完后立即保存）
-            qa_generator = QAGenerator(
-                pdf_dir=args.pdf_dir,
-                num_qa_pairs=args.num_qa,
-                max_workers=args.max_workers,
-                api_max_retries=args.api_retries,
-                api_retry_delay=args.retry_delay,
-                use_latex_ocr=args.use_latex_ocr,
-                answer_max_workers=args.answer_workers,
-                excel_writer=excel_writer,
-                mode=args.mode
-            )
-
-            # 从PDF生成问答对（每个PDF处理完后会自动保存到单独的JSON文件）
-            qa_results, failed_files = qa_generator.generate_qa_from_pdfs()
+            # 初始化Excel写入器和问答生成器（传入excel_writer，用于每个PDF处理完后立即保存），
+            # 退出with块时（包括出错时）关闭生成器并同步输出文件
+            with ExcelWriter(output_dir=args.output_dir, jsonl=args.jsonl_output) as excel_writer, \
+                    QAGenerator(
+                        pdf_dir=args.pdf_dir,
+                        num_qa_pairs=args.num_qa,
+                        max_workers=args.max_workers,
+                        api_max_retries=args.api_retries,
+                        api_retry_delay=args.retry_delay,
+                        use_latex_ocr=args.use_latex_ocr,
+                        answer_max_workers=args.answer_workers,
+                        excel_writer=excel_writer,
+                        mode=args.mode,
+                        latex_cache_dir=args.latex_cache_dir,
+                        formula_zoom=args.formula_zoom,
+                        formula_batch_size=args.formula_batch_size,
+                        answer_batch_size=args.answer_batch_size,
+                        answer_cache_dir=args.answer_cache_dir,
+                        semantic_cache=args.semantic_cache,
+                        answer_context_chunks=args.answer_context_chunks
+                    ) as qa_generator:
+                # 从PDF生成问答对（每个PDF处理完后立即保存）
+                qa_results, failed_files = qa_generator.generate_qa_from_pdfs()
         
         # 处理问答对生成的结果（适用于--from-txt和默认模式）
         if args.from_txt or not args.extract_only:
@@ -182,21 +227,24 @@ def main():
                         print(f"  - {file}")
                 return
 
-            logger.info(f"处理完成，每个PDF的结果已保存到 {args.output_dir} 目录下的单独JSON文件")
-            print(f"处理完成，每个PDF的结果已保存到 {args.output_dir} 目录下的单独JSON文件")
+            if args.jsonl_output:
+                jsonl_path = os.path.join(args.output_dir, args.mode, JSONL_FILENAME)
+                saved_message = f"处理完成，所有结果已追加写入 {jsonl_path}"
+            else:
+                saved_message = f"处理完成，每个PDF的结果已保存到 {args.output_dir} 目录下的单独JSON文件"
+            logger.info(saved_message)
+            print(saved_message)
 
             # 保存失败文件列表到单独的文本文件
             if failed_files:
                 failed_files_log = os.path.join(
                     args.output_dir, "failed_files.txt")
+                body = "\n".join(failed_files)
                 with open(failed_files_log, "w", encoding="utf-8") as f:
-                    f.write(f"处理失败的文件列表 ({len(failed_files)}):\n")
-                    for file in failed_files:
-                        f.write(f"{file}\n")
+                    f.write(f"处理失败的文件列表 ({len(failed_files)}):\n{body}\n")
 
-                print(f"\n处理失败的文件 ({len(failed_files)}):")
-                for file in failed_files:
-                    print(f"  - {file}")
+                print(f"\n处理失败的文件 ({len(failed_files)}):\n" +
+                      "\n".join(f"  - {file}" for file in failed_files))
                 print(f"失败文件列表已保存到: {failed_files_log}")
 
             # 打印统计信息
@@ -206,7 +254,11 @@ def main():
             print(f"- 成功处理文件数: {len(qa_results)}")
             print(f"- 生成问答对总数: {total_qa_pairs}")
             print(f"- 失败文件数: {len(failed_files)}")
-            print(f"\n每个PDF的问答对已保存为单独的JSON文件，文件名基于原PDF名称。")
+            if args.jsonl_output:
+                print(f"\n所有PDF的问答对已追加写入{JSONL_FILENAME}，每行一条记录；"
+                      f"可使用 --split_jsonl 拆分为每个PDF单独的JSON文件。")
+            else:
+                print(f"\n每个PDF的问答对已保存为单独的JSON文件，文件名基于原PDF名称。")
             print(f"所有结果文件位于: {os.path.abspath(args.output_dir)}")
 
     except Exception as e:
@@ -1,6 +1,16 @@
 import json
 import importlib.util
 import os
+import re
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import ijson
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # 确保导入本地 stat.py 文件而不是标准库的 stat 模块
 stat_path = os.path.join(os.path.dirname(__file__), 'stat.py')
@@ -9,89 +19,151 @@ stat_module = importlib.util.module_from_spec(spec)
 spec.loader.exec_module(stat_module)
 load_json_files = stat_module.load_json_files
 
+# 截断点之后需要去除的空白与“---”分隔线（配合match的pos参数使用）
+_PREFIX_JUNK_RE = re.compile(r'(?:\s|---)+')
+# 答案前100个字符内出现这些词时，说明开头是“基于文献”之类的客套话
+_BANNED_PREFIX_RE = re.compile(r'文献|严格基于|提供|以下')
+_QUESTION_PREFIXES = ("### **问题：", "问题：", "### 问题：")
+# 防止异常输入导致循环次数过多
+_MAX_STRIP_ROUNDS = 10
 
 
 def process_question(question):
     return question
 
 
+def _strip_from(answer, start):
+    """从start处截断answer，并去掉截断后开头的空白与“---”分隔线（只做一次切片）"""
+    match = _PREFIX_JUNK_RE.match(answer, start)
+    return answer[match.end() if match else start:]
+
+
 def process_answer(answer):
     # 如果ans以"好的"开头，则删除第一句话，即删除到第一个句号“。”
     if answer.startswith("好的"):
-        # 删除第一句话（即删除第一个“。”及其之前的所有内容）
-        if "。" in answer:
-            answer = answer[answer.find("。")+1:]
-        # 删除开头所有的换行符
-        answer = answer.lstrip("\n")
-        # 删除开头所有的空格
-        answer = answer.lstrip(" ")
-        # 删除开头的“---”
-        answer = answer.lstrip("\n---\n")
+        # 删除第一句话（即删除第一个“。”及其之前的所有内容），以及开头的换行、空格和“---”
+        answer = _strip_from(answer, answer.find("。") + 1)
         print(f"删除了“好的”话术: {answer[:10]}...")
 
-    while ("文献" in answer[:100] or "严格基于" in answer[:100] or "提供" in answer[:100] or "以下" in answer[:100]) and not answer.startswith("###"):
-        
+    rounds = 0
+    while rounds < _MAX_STRIP_ROUNDS and _BANNED_PREFIX_RE.search(answer, 0, 100) \
+            and not answer.startswith("###"):
+        rounds += 1
+
         # 删除第一句话，第一句话可能以“：”、“。”结尾
         idx = answer.find("：")
-        if idx != -1:
-            answer = answer[idx+1:]
-        else:
+        if idx == -1:
             idx = answer.find("。")
-            if idx != -1:
-                answer = answer[idx+1:]
-            else:
+            if idx == -1:
                 break
 
-        # 删除开头所有的换行符
-        answer = answer.lstrip("\n")
-        # 删除开头所有的空格
-        answer = answer.lstrip(" ")
-        # 删除开头的“---”
-        answer = answer.lstrip("\n---\n")
+        answer = _strip_from(answer, idx + 1)
         print(f"删除了“文献”、“严格基于”、“提供”等话术: {answer[:10]}...")
 
-    if answer.startswith("### **问题：") or  answer.startswith("问题：") or answer.startswith("### 问题："):
+    if answer.startswith(_QUESTION_PREFIXES):
         idx = answer.find("\n\n")
         if idx != -1:
-            answer = answer[idx+1:]
-            # 删除开头所有的换行符
-            answer = answer.lstrip("\n")
-            # 删除开头所有的空格
-            answer = answer.lstrip(" ")
-            # 删除开头的“---”
-            answer = answer.lstrip("\n---\n")
+            answer = _strip_from(answer, idx + 1)
             print(f"删除了“问题：”话术: {answer[:10]}...")
     return answer
 
 
-def post_process(qa_pairs):
-    new_qa_pairs = []
-    for qa_pair in qa_pairs:
-        qa_pair['question'] = process_question(qa_pair['question'])
-        qa_pair['answer'] = process_answer(qa_pair['answer'])
-        new_qa_pairs.append(qa_pair)
+def process_qa_pair(qa_pair):
+    qa_pair['question'] = process_question(qa_pair['question'])
+    qa_pair['answer'] = process_answer(qa_pair['answer'])
+    return qa_pair
 
-    return new_qa_pairs
+
+def post_process(qa_pairs):
+    return [process_qa_pair(qa_pair) for qa_pair in qa_pairs]
+
+
+def _dumps(obj):
+    """序列化为紧凑的UTF-8 JSON字节"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _build_value(first, events):
+    """从ijson事件流中构建一个完整的JSON值（first为该值的第一个事件）"""
+    builder = ijson.ObjectBuilder()
+    depth = 0
+    event_iter = itertools.chain((first,), events)
+    for _, event, value in event_iter:
+        builder.event(event, value)
+        if event in ('start_map', 'start_array'):
+            depth += 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
+        if depth == 0:
+            return builder.value
+    raise ValueError("JSON内容不完整")
+
+
+def _rewrite_qa_pairs(events, dst):
+    """逐条读取qa_pairs数组中的问答对，后处理后立即写出，内存中只保留当前一条"""
+    _, event, _ = next(events)
+    if event != 'start_array':
+        raise ValueError("qa_pairs不是数组")
+
+    dst.write(b'[')
+    first = True
+    for item_event in events:
+        if item_event[1] == 'end_array':
+            break
+        qa_pair = process_qa_pair(_build_value(item_event, events))
+        if not first:
+            dst.write(b',')
+        dst.write(_dumps(qa_pair))
+        first = False
+    dst.write(b']')
+
+
+def _process_file(json_file):
+    """流式处理单个JSON文件中的问答对，写入临时文件后原子替换原文件"""
+    tmp_file = json_file + ".tmp"
+    try:
+        with open(json_file, "rb") as src, open(tmp_file, "wb") as dst:
+            events = ijson.parse(src, use_float=True)
+            _, event, _ = next(events)
+            if event != 'start_map':
+                raise ValueError("顶层不是JSON对象")
+
+            # 保持原有字段顺序，只有qa_pairs逐条流式处理
+            dst.write(b'{')
+            first = True
+            for _, event, key in events:
+                if event == 'end_map':
+                    break
+                if not first:
+                    dst.write(b',')
+                dst.write(_dumps(key) + b':')
+                first = False
+                if key == 'qa_pairs':
+                    _rewrite_qa_pairs(events, dst)
+                else:
+                    dst.write(_dumps(_build_value(next(events), events)))
+            dst.write(b'}')
+        os.replace(tmp_file, json_file)
+    except Exception as e:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise RuntimeError(f"处理文件 {json_file} 时出错: {e}") from e
 
 
 def main():
     qa_dir = "./output/pro"
     json_files = load_json_files(qa_dir)
 
-    for json_file in json_files:
-        json_data = {}
-        new_qa_pairs = []
-        with open(json_file, "r", encoding="utf-8") as f:
-            json_data = json.load(f)
-            try:
-                new_qa_pairs = post_process(json_data['qa_pairs'])
-            except Exception as e:
-                print(f"处理文件 {json_file} 时出错: {e}")
-                exit(1)
-        json_data['qa_pairs'] = new_qa_pairs
-        with open(json_file, "w", encoding="utf-8") as f:
-            json.dump(json_data, f, ensure_ascii=False, indent=2)
+    # 各文件相互独立，按CPU核数多进程并行处理
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        try:
+            list(executor.map(_process_file, json_files, chunksize=8))
+        except Exception as e:
+            print(e)
+            exit(1)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
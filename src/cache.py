@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+LLM答案缓存
+精确匹配层：以完整提示词的SHA-256为键，存放在SQLite（WAL模式）中
+语义匹配层（可选）：同一文档内与已回答问题语义高度相似的问题直接复用答案，
+问题向量与答案一起存放在SQLite中，按文档作用域在内存中建立faiss索引，
+依赖sentence-transformers和faiss，未安装时自动关闭
+"""
+
+import os
+import hashlib
+import logging
+import sqlite3
+import threading
+
+try:
+    import numpy as np
+    import faiss
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    faiss = None
+    SentenceTransformer = None
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def content_scope(content):
+    """
+    计算文档的缓存作用域，语义匹配只在同一文档内进行，避免通用问题跨文档串用答案
+
+    Args:
+        content (str): 文档内容
+
+    Returns:
+        str: 作用域标识
+    """
+    return hashlib.sha256(content[:4096].encode('utf-8')).hexdigest()
+
+
+class AnswerCache:
+    """LLM答案缓存（精确匹配 + 可选的语义相似匹配），线程安全"""
+
+    def __init__(self, cache_dir, semantic=False, threshold=0.95,
+                 model_name='all-MiniLM-L6-v2'):
+        """
+        初始化缓存
+
+        Args:
+            cache_dir (str): 缓存目录
+            semantic (bool): 是否启用语义匹配
+            threshold (float): 语义匹配的余弦相似度阈值
+            model_name (str): 句向量模型名称
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        # 句向量模型不保证线程安全，get/put在多个线程中并发调用，编码需串行执行
+        self._encode_lock = threading.Lock()
+
+        self._conn = sqlite3.connect(
+            os.path.join(self.cache_dir, 'answers.db'), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, response TEXT NOT NULL)')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS semantic '
+            '(id INTEGER PRIMARY KEY, scope TEXT NOT NULL, response TEXT NOT NULL, vector BLOB)')
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(semantic)')]
+        if 'vector' not in columns:
+            # 旧版本的向量只保存在faiss文件中，这些记录没有向量，不再参与语义匹配
+            self._conn.execute('ALTER TABLE semantic ADD COLUMN vector BLOB')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS semantic_scope ON semantic (scope)')
+        self._conn.commit()
+
+        self._encoder = None
+        self._dim = None
+        # 文档作用域 -> 该文档已回答问题的向量索引，首次查询该文档时从SQLite加载
+        self._scope_indexes = {}
+        if semantic:
+            if SentenceTransformer is None:
+                logger.warning("未安装sentence-transformers或faiss，语义缓存已关闭")
+            else:
+                self._encoder = SentenceTransformer(model_name)
+                self._dim = self._encoder.get_sentence_embedding_dimension()
+
+        logger.info(f"答案缓存初始化，目录: {self.cache_dir}, 语义匹配: {self._encoder is not None}")
+
+    def _scope_index(self, scope):
+        """
+        获取文档作用域的向量索引，不存在时从SQLite加载（调用方需持有self._lock）
+
+        Args:
+            scope (str): 文档作用域
+
+        Returns:
+            faiss.Index: 向量索引
+        """
+        index = self._scope_indexes.get(scope)
+        if index is None:
+            # 向量已归一化，内积即余弦相似度；单个文档的问题数不多，精确检索即可
+            index = faiss.IndexIDMap2(faiss.IndexFlatIP(self._dim))
+            rows = self._conn.execute(
+                'SELECT id, vector FROM semantic WHERE scope = ? AND vector IS NOT NULL',
+                (scope,)).fetchall()
+            rows = [(idx, blob) for idx, blob in rows if len(blob) == self._dim * 4]
+            if rows:
+                vectors = np.frombuffer(b''.join(blob for _, blob in rows),
+                                        dtype=np.float32).reshape(len(rows), self._dim)
+                index.add_with_ids(vectors, np.array([idx for idx, _ in rows], dtype=np.int64))
+            self._scope_indexes[scope] = index
+        return index
+
+    @staticmethod
+    def _hash(prompt):
+        return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+    def _encode(self, texts):
+        """串行调用句向量模型，返回归一化后的float32向量矩阵"""
+        with self._encode_lock:
+            return self._encoder.encode(
+                texts, normalize_embeddings=True).astype(np.float32)
+
+    def cluster_questions(self, questions):
+        """
+        把语义高度相似（余弦相似度不低于threshold）的问题归为一组，每组只需请求一次答案
+
+        Args:
+            questions (list): 问题列表
+
+        Returns:
+            list: 与问题一一对应的代表问题下标（组内第一个问题），未启用语义匹配时返回None
+        """
+        if self._encoder is None or len(questions) < 2:
+            return None
+
+        vectors = self._encode(questions)
+        # 贪心归组：每个问题与已有代表问题比较，最相似者达到阈值则并入该组
+        representatives = []
+        assignment = []
+        for i, vector in enumerate(vectors):
+            if representatives:
+                scores = vectors[representatives] @ vector
+                best = int(scores.argmax())
+                if scores[best] >= self.threshold:
+                    assignment.append(representatives[best])
+                    continue
+            representatives.append(i)
+            assignment.append(i)
+        return assignment
+
+    def get(self, prompt, question=None, scope=None):
+        """
+        查询缓存：先精确匹配提示词，未命中且启用语义匹配时再查找同一文档内的相似问题
+
+        Args:
+            prompt (str): 完整的提示词
+            question (str): 问题文本（语义匹配用）
+            scope (str): 文档作用域，由content_scope计算（语义匹配用）
+
+        Returns:
+            str: 缓存的答案，未命中返回None
+        """
+        key = self._hash(prompt)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT response FROM answers WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            return row[0]
+
+        if self._encoder is None or question is None or scope is None:
+            return None
+
+        vector = self._encode([question])
+        with self._lock:
+            index = self._scope_index(scope)
+            if index.ntotal == 0:
+                return None
+            # 索引只包含本文档的问题，最相似的一个达不到阈值即未命中
+            scores, ids = index.search(vector, 1)
+            score, idx = scores[0][0], ids[0][0]
+            if idx < 0 or score < self.threshold:
+                return None
+            row = self._conn.execute(
+                'SELECT response FROM semantic WHERE id = ?', (int(idx),)).fetchone()
+        if row is not None:
+            logger.debug(f"语义缓存命中，相似度: {score:.3f}")
+            return row[0]
+        return None
+
+    def put(self, prompt, response, question=None, scope=None):
+        """
+        写入缓存
+
+        Args:
+            prompt (str): 完整的提示词
+            response (str): LLM返回的答案
+            question (str): 问题文本（语义匹配用）
+            scope (str): 文档作用域（语义匹配用）
+        """
+        key = self._hash(prompt)
+        vector = None
+        if self._encoder is not None and question is not None and scope is not None:
+            vector = self._encode([question])
+
+        try:
+            with self._lock:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO answers (key, response) VALUES (?, ?)',
+                    (key, response))
+                if vector is not None:
+                    # 向量随答案写入SQLite，不再每次写入都重写整个faiss索引文件
+                    cursor = self._conn.execute(
+                        'INSERT INTO semantic (scope, response, vector) VALUES (?, ?, ?)',
+                        (scope, response, vector.tobytes()))
+                    self._scope_index(scope).add_with_ids(
+                        vector, np.array([cursor.lastrowid], dtype=np.int64))
+                self._conn.commit()
+        except Exception as e:
+            logger.debug(f"写入答案缓存失败: {str(e)}")
+
+    def close(self):
+        """关闭数据库连接并释放内存中的向量索引"""
+        with self._lock:
+            self._scope_indexes.clear()
+            self._conn.close()
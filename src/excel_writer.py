@@ -4,37 +4,68 @@
 import os
 import pandas as pd
 import logging
-from datetime import datetime
 import json
 import re
 import threading
 import time
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 每个模式输出目录下的已处理文件索引
+INDEX_FILENAME = "_index.json"
+# JSONL输出模式下每个模式输出目录中的追加写结果文件
+JSONL_FILENAME = "results.jsonl"
+
 
 class ExcelWriter:
     """增强版Excel文件写入类，支持多层次问答对和元数据"""
 
-    def __init__(self, output_dir="output"):
+    # JSONL输出模式下每追加多少条记录执行一次fsync并落盘输出索引
+    JSONL_SYNC_EVERY = 64
+    # 单独JSON文件输出模式下每保存多少个文件落盘一次输出索引
+    INDEX_SYNC_EVERY = 64
+
+    def __init__(self, output_dir="output", jsonl=False):
         """
         初始化Excel写入器
 
         Args:
             output_dir (str): 输出目录路径
+            jsonl (bool): 是否把所有结果追加写入每个模式目录下的results.jsonl，
+                          而不是每个PDF单独保存一个JSON文件
         """
         # 转换为绝对路径，确保多线程环境下路径一致
         self.output_dir = os.path.abspath(output_dir)
 
-        # 文件写入锁，防止并发写入冲突
-        self._file_lock = threading.Lock()
-
         # 文件计数器，用于生成唯一文件名
         self._file_counter = 0
         self._counter_lock = threading.Lock()
 
+        # 各模式输出目录的已处理文件索引（源文件名 -> 输出JSON路径），首次使用时加载
+        self._indexes = {}
+        self._index_lock = threading.Lock()
+        # 内存中已更新但尚未落盘的索引所属模式，及自上次落盘以来登记的文件数
+        self._dirty_indexes = set()
+        self._index_unsaved = 0
+
+        # JSONL输出：各模式打开的追加写文件句柄及自上次fsync以来追加的记录数
+        self.jsonl = jsonl
+        self._jsonl_files = {}
+        self._jsonl_unsynced = 0
+        self._jsonl_lock = threading.Lock()
+
         # 确保输出目录存在
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir, exist_ok=True)
@@ -86,6 +117,210 @@ class ExcelWriter:
             self._file_counter += 1
             return self._file_counter
 
+    def _index_path(self, mode):
+        return os.path.join(self.output_dir, mode, INDEX_FILENAME)
+
+    @staticmethod
+    def _read_source(json_path):
+        """
+        读取输出JSON文件中的source字段
+        source位于文件开头，使用ijson流式解析读到该字段即停止，无需解析整个问答对列表
+
+        Args:
+            json_path (str): 输出JSON文件路径
+
+        Returns:
+            str: 源文件名，不存在返回None
+        """
+        with open(json_path, 'rb') as f:
+            if ijson is not None:
+                return next(ijson.items(f, 'source'), None)
+            return json.load(f).get('source')
+
+    @staticmethod
+    def _read_jsonl_sources(jsonl_path):
+        """
+        读取JSONL结果文件中每条记录的source字段
+
+        Args:
+            jsonl_path (str): JSONL文件路径
+
+        Returns:
+            list: 源文件名列表（按写入顺序）
+        """
+        # 逐行解析：进程中断可能在文件末尾留下半行，跳过无法解析的行而不是整个文件读取失败
+        sources = []
+        with open(jsonl_path, 'rb') as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = orjson.loads(line) if orjson is not None else json.loads(line)
+                    sources.append(record.get("source"))
+                except Exception as e:
+                    logger.warning(f"跳过 {jsonl_path} 中无法解析的第 {line_no} 行: {str(e)}")
+        return sources
+
+    def _rebuild_index(self, mode):
+        """
+        扫描输出目录中的所有JSON文件重建索引（仅在索引文件缺失或损坏时执行一次）
+
+        Args:
+            mode (str): 模式
+
+        Returns:
+            dict: 源文件名 -> 输出JSON路径
+        """
+        index = {}
+        mode_dir = os.path.join(self.output_dir, mode)
+        if not os.path.isdir(mode_dir):
+            return index
+
+        with os.scandir(mode_dir) as it:
+            for entry in it:
+                if entry.name == JSONL_FILENAME:
+                    try:
+                        for source in self._read_jsonl_sources(entry.path):
+                            if source:
+                                index[source] = entry.path
+                    except Exception as e:
+                        logger.debug(f"读取JSONL文件 {entry.path} 时出错: {e}")
+                    continue
+                if not entry.name.endswith('.json') or entry.name == INDEX_FILENAME:
+                    continue
+                try:
+                    source = self._read_source(entry.path)
+                    if source:
+                        index[source] = entry.path
+                except Exception as e:
+                    logger.debug(f"读取JSON文件 {entry.path} 时出错: {e}")
+
+        logger.info(f"已重建 {mode} 模式的输出索引，共 {len(index)} 个文件")
+        return index
+
+    def _write_index(self, mode, index):
+        """原子地写入索引文件（先写临时文件再重命名）"""
+        index_path = self._index_path(mode)
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        tmp_path = f"{index_path}.tmp"
+        if orjson is not None:
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(index))
+        else:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, index_path)
+
+    def _load_index_locked(self, mode):
+        index = self._indexes.get(mode)
+        if index is not None:
+            return index
+
+        try:
+            with open(self._index_path(mode), 'rb') as f:
+                index = json.loads(f.read())
+        except FileNotFoundError:
+            index = None
+        except Exception as e:
+            logger.warning(f"读取输出索引失败，将重新扫描输出目录: {str(e)}")
+            index = None
+
+        if index is None:
+            index = self._rebuild_index(mode)
+            if index:
+                self._write_index(mode, index)
+
+        self._indexes[mode] = index
+        return index
+
+    def get_processed_index(self, mode):
+        """
+        获取已处理文件索引（源文件名 -> 输出JSON路径），结果在内存中缓存
+
+        Args:
+            mode (str): 模式
+
+        Returns:
+            dict: 索引的副本
+        """
+        with self._index_lock:
+            return dict(self._load_index_locked(mode))
+
+    def _add_to_index(self, mode, source, json_filepath):
+        """
+        将新保存的输出文件登记到内存中的索引，每INDEX_SYNC_EVERY个文件及close时才落盘。
+        进程异常退出时最近未落盘的文件不在索引中，下次运行会重新处理
+        """
+        with self._index_lock:
+            self._load_index_locked(mode)[source] = json_filepath
+            self._dirty_indexes.add(mode)
+            self._index_unsaved += 1
+            if self._index_unsaved >= self.INDEX_SYNC_EVERY:
+                self._flush_indexes_locked()
+
+    def _flush_indexes_locked(self):
+        """把内存中有更新的输出索引写入磁盘（调用方需持有self._index_lock）"""
+        for mode in self._dirty_indexes:
+            self._write_index(mode, self._indexes[mode])
+        self._dirty_indexes.clear()
+        self._index_unsaved = 0
+
+    def _build_record(self, qa_pairs, source, metadata):
+        """
+        构造单个PDF的输出记录
+
+        Returns:
+            tuple: (输出记录, 时间戳字符串, 纳秒部分)
+        """
+        # 只取一次当前时间，避免两次调用之间跨秒导致时间戳与小数部分不一致
+        now_ns = time.time_ns()
+        timestamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(now_ns // 1_000_000_000))
+        record = {
+            "source": source,
+            "metadata": metadata or {},
+            "qa_pairs": qa_pairs,
+            "generated_at": timestamp,
+            "total_qa_pairs": len(qa_pairs),
+            "thread_id": threading.current_thread().name  # 添加线程信息用于调试
+        }
+        return record, timestamp, now_ns % 1_000_000_000
+
+    def _write_json_file(self, record, mode, timestamp, nanosecond):
+        """
+        把一条输出记录保存为单独的JSON文件（不更新索引）
+
+        Returns:
+            str: 保存的JSON文件路径
+        """
+        # 清理文件名
+        sanitized_name = self._sanitize_filename(record["source"])
+
+        # 生成唯一的文件名（时间戳 + 纳秒 + 计数器，确保唯一性）
+        counter = self._get_unique_counter()
+        json_filename = f"{sanitized_name}_{timestamp}_{nanosecond:09d}_{counter:04d}.json"
+
+        # 使用绝对路径，确保多线程环境下路径一致
+        output_dir = os.path.abspath(os.path.join(self.output_dir, mode))
+        os.makedirs(output_dir, exist_ok=True)
+        json_filepath = os.path.join(output_dir, json_filename)
+
+        # 保存JSON文件（紧凑格式；优先使用orjson一次性序列化）
+        if orjson is not None:
+            with open(json_filepath, 'wb') as f:
+                f.write(orjson.dumps(record, option=orjson.OPT_NON_STR_KEYS))
+        else:
+            with open(json_filepath, 'w', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False, separators=(',', ':'))
+
+        # 调试模式下验证文件是否成功写入
+        if logger.isEnabledFor(logging.DEBUG):
+            if not os.path.exists(json_filepath):
+                raise IOError(f"文件写入后不存在: {json_filepath}")
+            logger.debug(
+                f"文件 {json_filepath} 大小: {os.path.getsize(json_filepath)} bytes")
+
+        return json_filepath
+
     def save_single_pdf_qa(self, qa_pairs, source, metadata, mode):
         """
         保存单个PDF的问答对到JSON文件（线程安全）
@@ -98,52 +333,149 @@ class ExcelWriter:
         Returns:
             str: 保存的JSON文件路径，失败返回空字符串
         """
-        # 使用锁确保文件写入的线程安全
-        with self._file_lock:
-            try:
-                # 清理文件名
-                sanitized_name = self._sanitize_filename(source)
-
-                # 生成唯一的文件名（时间戳 + 微秒 + 计数器，确保唯一性）
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                microsecond = datetime.now().microsecond
-                counter = self._get_unique_counter()
-                json_filename = f"{sanitized_name}_{timestamp}_{microsecond:06d}_{counter:04d}.json"
-                
-                # 使用绝对路径，确保多线程环境下路径一致
-                output_dir = os.path.abspath(os.path.join(self.output_dir, mode))
-                if not os.path.exists(output_dir):
-                    os.makedirs(output_dir, exist_ok=True)
-                json_filepath = os.path.join(output_dir, json_filename)
-
-                # 准备JSON数据
-                json_data = {
-                    "source": source,
-                    "metadata": metadata or {},
-                    "qa_pairs": qa_pairs,
-                    "generated_at": timestamp,
-                    "total_qa_pairs": len(qa_pairs),
-                    "thread_id": threading.current_thread().name  # 添加线程信息用于调试
-                }
-
-                # 保存JSON文件
-                with open(json_filepath, 'w', encoding='utf-8') as f:
-                    json.dump(json_data, f, ensure_ascii=False, indent=2)
-
-                # 验证文件是否成功写入
-                if not os.path.exists(json_filepath):
-                    raise IOError(f"文件写入后不存在: {json_filepath}")
-
-                file_size = os.path.getsize(json_filepath)
-                logger.info(
-                    f"成功保存 {source} 的 {len(qa_pairs)} 个问答对到: {json_filepath} "
-                    f"(大小: {file_size} bytes, 线程: {threading.current_thread().name})")
-
-                return json_filepath
-
-            except Exception as e:
-                logger.error(
-                    f"保存单个PDF问答对时出错 ({source}): {str(e)}, "
-                    f"线程: {threading.current_thread().name}",
-                    exc_info=True)
-                return ""
+        if self.jsonl:
+            return self.append_jsonl(qa_pairs, source, metadata, mode)
+
+        # 文件名由计数器保证唯一，各次保存互不冲突，无需全局锁
+        try:
+            record, timestamp, nanosecond = self._build_record(qa_pairs, source, metadata)
+            json_filepath = self._write_json_file(record, mode, timestamp, nanosecond)
+
+            # 登记到输出索引，后续运行无需扫描全部JSON即可判断是否已处理
+            self._add_to_index(mode, source, json_filepath)
+
+            logger.info(
+                f"成功保存 {source} 的 {len(qa_pairs)} 个问答对到: {json_filepath} "
+                f"(线程: {record['thread_id']})")
+
+            return json_filepath
+
+        except Exception as e:
+            logger.error(
+                f"保存单个PDF问答对时出错 ({source}): {str(e)}, "
+                f"线程: {threading.current_thread().name}",
+                exc_info=True)
+            return ""
+
+    def _sync_jsonl_locked(self):
+        """fsync所有打开的JSONL文件，并把内存中的输出索引落盘"""
+        for mode, f in self._jsonl_files.items():
+            f.flush()
+            os.fsync(f.fileno())
+        with self._index_lock:
+            self._flush_indexes_locked()
+        self._jsonl_unsynced = 0
+
+    def append_jsonl(self, qa_pairs, source, metadata, mode):
+        """
+        把单个PDF的问答对作为一行追加到该模式的results.jsonl（线程安全）
+        每JSONL_SYNC_EVERY条记录才fsync并写一次索引，进程异常退出时最近未同步的记录
+        可能未登记到索引，下次运行会重新处理（重复记录在拆分时以最后一条为准）
+
+        Args:
+            qa_pairs (list): 问答对列表
+            source (str): 源文件名
+            metadata (dict): PDF元数据
+            mode (str): 模式
+
+        Returns:
+            str: JSONL文件路径，失败返回空字符串
+        """
+        try:
+            record, _, _ = self._build_record(qa_pairs, source, metadata)
+            if orjson is not None:
+                line = orjson.dumps(record, option=orjson.OPT_NON_STR_KEYS) + b"\n"
+            else:
+                line = (json.dumps(record, ensure_ascii=False, separators=(',', ':')) +
+                        "\n").encode('utf-8')
+
+            jsonl_path = os.path.join(self.output_dir, mode, JSONL_FILENAME)
+            with self._jsonl_lock:
+                f = self._jsonl_files.get(mode)
+                if f is None:
+                    os.makedirs(os.path.dirname(jsonl_path), exist_ok=True)
+                    f = open(jsonl_path, 'ab')
+                    self._jsonl_files[mode] = f
+                f.write(line)
+                f.flush()
+
+                # 只更新内存中的索引，由_sync_jsonl_locked批量落盘
+                with self._index_lock:
+                    self._load_index_locked(mode)[source] = jsonl_path
+                    self._dirty_indexes.add(mode)
+
+                self._jsonl_unsynced += 1
+                if self._jsonl_unsynced >= self.JSONL_SYNC_EVERY:
+                    self._sync_jsonl_locked()
+
+            logger.info(
+                f"成功追加 {source} 的 {len(qa_pairs)} 个问答对到: {jsonl_path} "
+                f"(线程: {record['thread_id']})")
+            return jsonl_path
+
+        except Exception as e:
+            logger.error(
+                f"追加JSONL记录时出错 ({source}): {str(e)}, "
+                f"线程: {threading.current_thread().name}",
+                exc_info=True)
+            return ""
+
+    def close(self):
+        """同步并关闭JSONL文件，并把尚未落盘的输出索引写入磁盘"""
+        with self._jsonl_lock:
+            if self._jsonl_files:
+                self._sync_jsonl_locked()
+                for f in self._jsonl_files.values():
+                    f.close()
+                self._jsonl_files = {}
+        with self._index_lock:
+            self._flush_indexes_locked()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def split_jsonl_to_files(self, mode):
+        """
+        把某模式的results.jsonl拆分为每个PDF单独的JSON文件（同一源文件以最后一条记录为准），
+        更新输出索引后删除JSONL文件。需在没有写入进行时调用
+
+        Args:
+            mode (str): 模式
+
+        Returns:
+            int: 生成的JSON文件数
+        """
+        self.close()
+        jsonl_path = os.path.join(self.output_dir, mode, JSONL_FILENAME)
+        if not os.path.exists(jsonl_path):
+            logger.warning(f"JSONL文件不存在: {jsonl_path}")
+            return 0
+
+        records = {}
+        with open(jsonl_path, 'rb') as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = orjson.loads(line) if orjson is not None else json.loads(line)
+                except Exception as e:
+                    logger.warning(f"跳过无法解析的第 {line_no} 行: {str(e)}")
+                    continue
+                records[record.get("source")] = record
+
+        written = {}
+        for source, record in records.items():
+            timestamp = record.get("generated_at") or time.strftime("%Y%m%d_%H%M%S")
+            written[source] = self._write_json_file(record, mode, timestamp, 0)
+
+        with self._index_lock:
+            index = self._load_index_locked(mode)
+            index.update(written)
+            self._write_index(mode, index)
+
+        os.remove(jsonl_path)
+        logger.info(f"已将 {jsonl_path} 拆分为 {len(written)} 个JSON文件")
+        return len(written)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+LaTeX公式识别结果缓存
+以公式图像尺寸和原始像素字节的SHA-256为键，缓存LatexOCR的识别结果，避免重复推理
+"""
+
+import os
+import hashlib
+import logging
+import threading
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class LatexCache:
+    """内容寻址的LaTeX识别结果缓存（进程内内存缓存 + 可选的磁盘缓存）"""
+
+    def __init__(self, cache_dir=None):
+        """
+        初始化缓存
+
+        Args:
+            cache_dir (str): 磁盘缓存目录，为None时仅使用本次运行的内存缓存
+        """
+        self.cache_dir = os.path.abspath(cache_dir) if cache_dir else None
+        self._memory = {}
+        self._lock = threading.Lock()
+
+        if self.cache_dir and not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            logger.info(f"创建LaTeX缓存目录: {self.cache_dir}")
+
+    @staticmethod
+    def make_key(width, height, samples):
+        """
+        计算公式图像的缓存键
+
+        Args:
+            width (int): 图像宽度
+            height (int): 图像高度
+            samples (bytes): 原始像素字节
+
+        Returns:
+            str: SHA-256十六进制摘要（带上尺寸，避免不同形状的图像像素序列相同）
+        """
+        digest = hashlib.sha256(f"{width}x{height}:".encode())
+        digest.update(samples)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.txt")
+
+    def get(self, key):
+        """
+        查询缓存
+
+        Args:
+            key (str): make_key计算出的缓存键
+
+        Returns:
+            str: 缓存的LaTeX字符串，未命中返回None
+        """
+        latex = self._memory.get(key)
+        if latex is not None or not self.cache_dir:
+            return latex
+
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                latex = f.read()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.debug(f"读取LaTeX缓存失败: {str(e)}")
+            return None
+
+        with self._lock:
+            self._memory[key] = latex
+        return latex
+
+    def set(self, key, latex):
+        """
+        写入缓存
+
+        Args:
+            key (str): make_key计算出的缓存键
+            latex (str): 识别出的LaTeX字符串
+        """
+        with self._lock:
+            self._memory[key] = latex
+
+        if not self.cache_dir:
+            return
+
+        try:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再重命名，避免并发读取到不完整内容
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(latex)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.debug(f"写入LaTeX缓存失败: {str(e)}")
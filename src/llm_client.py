@@ -1,7 +1,12 @@
 import os
 import logging
 import time
-from openai import OpenAI
+import asyncio
+import queue
+import threading
+import httpx
+from concurrent.futures import Future, ThreadPoolExecutor
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
 
 logging.basicConfig(level=logging.INFO,
@@ -12,119 +17,309 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 
+class _JSONObjectScanner:
+    """增量扫描流式文本，切分出完整的顶层JSON对象（{...}），正确处理字符串中的括号和转义"""
+
+    def __init__(self):
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, text):
+        """
+        送入一段新文本
+
+        Args:
+            text (str): 流式响应中新到达的文本片段
+
+        Returns:
+            list: 本次新闭合的顶层对象文本列表
+        """
+        objects = []
+        for ch in text:
+            if self._depth == 0:
+                # 对象之外的内容（数组括号、逗号、代码块标记等）直接丢弃
+                if ch == '{':
+                    self._depth = 1
+                    self._buffer = [ch]
+                continue
+
+            self._buffer.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == '{':
+                self._depth += 1
+            elif ch == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    objects.append(''.join(self._buffer))
+                    self._buffer = []
+        return objects
+
+
+class _AdaptiveBatcher:
+    """
+    单答案请求合并器：后台线程从队列中收集多个调用方（可来自不同PDF的线程和事件循环）
+    并发提交的提示词，合并为一次多提示词请求发送，结果通过Future返回。
+    所有发送线程都在忙时新请求在队列中累积，空出发送线程后一次取走，批大小随排队深度自适应
+    """
+
+    # 凑批时等待更多请求的最长时间（秒）
+    BATCH_TIMEOUT = 0.01
+    # 队列中的停止标记
+    _STOP = object()
+
+    def __init__(self, send_fn, max_batch=32, max_in_flight=4, max_pending=256):
+        """
+        初始化并启动合并线程
+
+        Args:
+            send_fn: 批量发送函数，输入提示词列表，返回等长的答案列表
+            max_batch (int): 单次请求的最大提示词数
+            max_in_flight (int): 同时进行中的批量请求数
+            max_pending (int): 队列容量，队列满时提交方阻塞
+        """
+        self._send = send_fn
+        self.max_batch = max(1, max_batch)
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._slots = threading.Semaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_in_flight, thread_name_prefix="LLMBatch")
+        self._thread = threading.Thread(
+            target=self._run, name="LLMBatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt):
+        """
+        提交一个提示词
+
+        Args:
+            prompt (str): 完整的提示词
+
+        Returns:
+            Future: 结果为答案字符串
+        """
+        future = Future()
+        self._queue.put((prompt, future))
+        return future
+
+    def _drain(self):
+        """阻塞等待第一个请求，再取走已排队的请求，队列已空时最多再等待BATCH_TIMEOUT"""
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.BATCH_TIMEOUT
+        while len(items) < self.max_batch and items[-1] is not self._STOP:
+            try:
+                items.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _dispatch(self, items):
+        try:
+            answers = self._send([prompt for prompt, _ in items])
+        except Exception as e:
+            for _, future in items:
+                future.set_exception(e)
+        else:
+            for (_, future), answer in zip(items, answers):
+                future.set_result(answer)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """发送完已排队的请求后停止合并线程和发送线程池"""
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def _run(self):
+        while True:
+            # 先占用发送槽位再凑批：槽位全忙期间请求留在队列中，之后合并成更大的批
+            self._slots.acquire()
+            items = self._drain()
+            stop = items[-1] is self._STOP
+            if stop:
+                items.pop()
+            if items:
+                self._executor.submit(self._dispatch, items)
+            else:
+                self._slots.release()
+            if stop:
+                return
+
+
 class LLMClient:
     """LLM API客户端类（使用OpenAI SDK）"""
 
-    def __init__(self, max_retries=3, retry_delay=2):
+    # 空闲的keep-alive连接保留时间（秒）。答案生成单次耗时较长，
+    # httpx默认的5秒会让多数连接在两次请求之间被关闭，需要重新握手
+    KEEPALIVE_EXPIRY = 300
+
+    def __init__(self, max_retries=3, retry_delay=2, pool_size=32):
         """
         初始化LLM API客户端
 
         Args:
             max_retries (int): 最大重试次数
             retry_delay (int): 重试间隔时间(秒)
+            pool_size (int): 连接池大小，所有线程共用同一个池中的keep-alive连接
         """
         self.api_key = os.getenv("API_KEY")
         self.api_base = os.getenv(
             "BASE_URL", "https://api.chatanywhere.tech/v1")
         self.max_retries = max_retries
         self.retry_delay = retry_delay
+        # 是否为共享前缀显式添加cache_control标记（Anthropic风格的提示词缓存，需要服务端支持）；
+        # 未开启时依赖服务端对相同前缀的自动缓存
+        self.prompt_cache_control = os.getenv(
+            "PROMPT_CACHE_CONTROL", "").lower() in ("1", "true", "yes")
+        # 大于0时，并发到达的单答案请求合并为一次/completions多提示词请求（prompt为列表），
+        # 需要服务端支持（如vLLM）；合并请求不经过对话模板，也不添加cache_control标记
+        self.completions_batch_size = int(os.getenv("COMPLETIONS_BATCH_SIZE", "0") or 0)
 
         if not self.api_key:
             logger.error("未设置API_KEY环境变量")
             raise ValueError("请设置API_KEY环境变量")
 
-        # 初始化OpenAI客户端，指向LLM API
+        self.pool_size = max(1, pool_size)
+
+        # 初始化OpenAI客户端，指向LLM API；所有线程共用该客户端的连接池
         self.client = OpenAI(
             api_key=self.api_key,
-            base_url=self.api_base
+            base_url=self.api_base,
+            http_client=DefaultHttpxClient(limits=self._connection_limits())
         )
 
+        self._batcher = None
+        if self.completions_batch_size > 0:
+            self._batcher = _AdaptiveBatcher(
+                self._complete_batch, max_batch=self.completions_batch_size)
+            logger.info(f"已开启答案请求合并，单次请求最多 {self.completions_batch_size} 个提示词")
+
         logger.info("LLM API客户端初始化完成")
 
-    def generate_qa_pairs(self, prompt, num_pairs=10):
+    def stream_qa_pairs(self, prompt, num_pairs=10):
         """
-        使用OpenAI SDK生成问答对，带有重试机制
+        流式生成问答对：边接收响应边解析，每闭合一个问答对对象就立即产出
+
+        响应结束后再从完整文本中提取JSON数组解析一遍，补上增量扫描遗漏的问答对
+        （如前言中的游离括号导致扫描错位）。
+        未产出任何问答对时按重试机制重新请求；已产出部分后连接中断则保留已产出的问答对结束
 
         Args:
             prompt (str): 完整的提示词
             num_pairs (int): 期望生成的问答对数量
 
-        Returns:
-            list: 问答对列表
+        Yields:
+            dict: 解析出的问答对对象（包含question和answer字段）
         """
-        # 实现重试机制
+        import json
+        import re
+
+        def is_qa(obj):
+            return isinstance(obj, dict) and 'question' in obj and 'answer' in obj
+
         attempts = 0
         while attempts < self.max_retries:
             attempts += 1
+            yielded = 0
             try:
-                if attempts == 1:
-                    # logger.info("开始调用LLM API生成问答对")
-                    pass
-                else:
+                if attempts > 1:
                     logger.info(
                         f"重试调用LLM API (第 {attempts-1}/{self.max_retries-1} 次重试)")
 
-                # 使用OpenAI SDK调用API
-                response = self.client.chat.completions.create(
+                stream = self.client.chat.completions.create(
                     model=os.getenv("MODEL_NAME", "deepseek-v3"),
                     messages=[
                         {"role": "user", "content": prompt}
                     ],
                     temperature=0.7,
-                    max_tokens=20000  # 增加token数量以支持更复杂的回答
+                    max_tokens=20000,
+                    stream=True
                 )
 
-                # 获取响应文本
-                response_text = response.choices[0].message.content
-
-                # 尝试解析JSON
-                import json
-                import re
-
-                try:
-                    # 尝试直接解析JSON
-                    qa_pairs = json.loads(response_text)
-                    logger.info(f"成功生成 {len(qa_pairs)} 个问答对")
-
-                    # 验证问答对格式
-                    self._validate_qa_pairs(qa_pairs)
-
-                    return qa_pairs
-                except json.JSONDecodeError:
-                    # 如果直接解析失败，尝试从文本中提取JSON部分
-                    json_match = re.search(
-                        r'\[\s*{.*}\s*\]', response_text, re.DOTALL)
-                    if json_match:
+                scanner = _JSONObjectScanner()
+                # 保留完整响应文本，供流结束后的整体解析兜底
+                parts = []
+                # 已产出问答对的(question, answer)，兜底解析时不重复产出
+                seen = set()
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    parts.append(delta)
+                    for text in scanner.feed(delta):
                         try:
-                            qa_pairs = json.loads(json_match.group(0))
-                            logger.info(f"成功从部分响应中提取并生成 {len(qa_pairs)} 个问答对")
-
-                            # 验证问答对格式
-                            self._validate_qa_pairs(qa_pairs)
-
-                            return qa_pairs
+                            qa = json.loads(text)
                         except json.JSONDecodeError:
-                            logger.error("无法解析API返回的JSON格式")
-                            # 继续重试
-                    else:
-                        logger.error("无法从API响应中提取JSON")
-                        logger.debug(f"API响应内容: {response_text[:200]}...")
-                        # 继续重试
+                            logger.debug(f"跳过无法解析的问答对: {text[:200]}...")
+                            continue
+                        if not is_qa(qa):
+                            logger.debug(f"跳过缺少question/answer字段的对象: {text[:200]}...")
+                            continue
+                        seen.add((str(qa['question']), str(qa['answer'])))
+                        yielded += 1
+                        yield qa
+
+                # 兜底：从完整文本中提取JSON数组整体解析，产出增量扫描未得到的问答对
+                json_match = re.search(r'\[\s*{.*}\s*\]', ''.join(parts), re.DOTALL)
+                if json_match:
+                    try:
+                        qa_pairs = json.loads(json_match.group(0))
+                    except json.JSONDecodeError:
+                        qa_pairs = []
+                    recovered = 0
+                    for qa in qa_pairs if isinstance(qa_pairs, list) else []:
+                        if not is_qa(qa):
+                            continue
+                        key = (str(qa['question']), str(qa['answer']))
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                        recovered += 1
+                        yielded += 1
+                        yield qa
+                    if recovered:
+                        logger.info(f"从完整响应中补充解析出 {recovered} 个问答对")
+
+                if yielded:
+                    logger.info(f"成功流式生成 {yielded} 个问答对（期望 {num_pairs} 个）")
+                    return
+                logger.error("无法从API流式响应中解析出问答对")
 
             except Exception as e:
+                if yielded:
+                    logger.error(f"流式响应中断，保留已生成的 {yielded} 个问答对: {str(e)}")
+                    return
+
                 logger.error(f"调用LLM API生成问答对时出错: {str(e)}")
-                # 如果已经达到最大重试次数，则退出循环
                 if attempts >= self.max_retries:
                     break
 
-                # 否则等待后继续重试
-                wait_time = self.retry_delay * (attempts-1)  # 指数退避策略
+                wait_time = self.retry_delay * (attempts-1)
                 logger.info(f"将在 {wait_time} 秒后进行重试")
                 time.sleep(wait_time)
 
-        # 如果所有重试都失败了
         logger.error(f"经过 {self.max_retries} 次尝试后，仍然无法成功调用LLM API")
-        return []
 
     def generate_questions(self, prompt, num_questions=10):
         """
@@ -216,12 +411,136 @@ class LLMClient:
         logger.error(f"经过 {self.max_retries} 次尝试后，仍然无法成功生成问题")
         return []
 
-    def generate_single_answer(self, prompt):
+    def close(self):
+        """停止请求合并线程（如已开启）并关闭同步客户端的连接池"""
+        if self._batcher is not None:
+            self._batcher.close()
+            self._batcher = None
+        self.client.close()
+
+    def _build_messages(self, prompt, cache_prefix=None):
         """
-        为单个问题生成详细答案
+        构造请求消息；开启cache_control时把共享前缀拆成单独的带缓存标记的文本段
 
         Args:
+            prompt (str): 完整的提示词
+            cache_prefix (str): 同一文档各请求共用的提示词前缀
+
+        Returns:
+            list: messages参数
+        """
+        if self.prompt_cache_control and cache_prefix and prompt.startswith(cache_prefix):
+            return [{
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": cache_prefix,
+                     "cache_control": {"type": "ephemeral"}},
+                    {"type": "text", "text": prompt[len(cache_prefix):]}
+                ]
+            }]
+        return [{"role": "user", "content": prompt}]
+
+    def _complete_batch(self, prompts):
+        """
+        一次/completions请求为多个提示词生成答案（_AdaptiveBatcher的发送函数）
+
+        Args:
+            prompts (list): 提示词列表
+
+        Returns:
+            list: 与提示词顺序一一对应的答案列表，缺失的答案为空字符串
+        """
+        response = self.client.completions.create(
+            model=os.getenv("MODEL_NAME", "deepseek-chat"),
+            prompt=prompts,
+            temperature=0.8,
+            max_tokens=20000
+        )
+        answers = [""] * len(prompts)
+        for choice in response.choices:
+            if 0 <= choice.index < len(prompts):
+                answers[choice.index] = (choice.text or "").strip()
+        logger.info(f"合并请求完成，共 {len(prompts)} 个提示词")
+        return answers
+
+    def _parse_batch_answers(self, response_text, num_answers):
+        """
+        解析批量答案的JSON响应，并按问题序号对齐
+
+        Args:
+            response_text (str): API响应文本
+            num_answers (int): 问题数量
+
+        Returns:
+            list: 与问题顺序一一对应的答案列表（缺失的答案为空字符串），无法解析时返回None
+        """
+        import json
+        import re
+
+        try:
+            answers_data = json.loads(response_text)
+        except json.JSONDecodeError:
+            # 如果直接解析失败，尝试从文本中提取JSON部分
+            json_match = re.search(
+                r'\[\s*{.*}\s*\]', response_text, re.DOTALL)
+            if not json_match:
+                logger.error("无法从API响应中提取答案JSON")
+                logger.debug(f"API响应内容: {response_text[:200]}...")
+                return None
+            try:
+                answers_data = json.loads(json_match.group(0))
+            except json.JSONDecodeError:
+                logger.error("无法解析API返回的答案JSON格式")
+                return None
+
+        # 按问题序号对齐答案，序号缺失或越界的条目忽略
+        answers = [""] * num_answers
+        for item in answers_data:
+            if not isinstance(item, dict):
+                continue
+            try:
+                idx = int(item.get("id")) - 1
+            except (TypeError, ValueError):
+                continue
+            answer = item.get("answer")
+            if 0 <= idx < num_answers and isinstance(answer, str):
+                answers[idx] = answer.strip()
+        return answers
+
+    def _connection_limits(self):
+        """
+        连接池限制：保持的keep-alive连接数与连接池大小一致，空闲连接保留更长时间
+
+        Returns:
+            httpx.Limits: 连接池限制
+        """
+        return httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.pool_size,
+            keepalive_expiry=self.KEEPALIVE_EXPIRY
+        )
+
+    def async_session(self):
+        """
+        创建异步客户端，需在事件循环内通过 async with 使用，退出时关闭连接池
+
+        Returns:
+            AsyncOpenAI: 异步客户端
+        """
+        return AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.api_base,
+            http_client=DefaultAsyncHttpxClient(limits=self._connection_limits())
+        )
+
+    async def agenerate_single_answer(self, session, prompt, cache_prefix=None):
+        """
+        为单个问题生成详细答案（异步版本）
+
+        Args:
+            session (AsyncOpenAI): async_session创建的异步客户端
             prompt (str): 完整的提示词（包含问题和文档内容）
+            cache_prefix (str): 同一文档各请求共用的提示词前缀（可选，用于提示词缓存）
 
         Returns:
             str: 生成的答案，如果失败返回空字符串
@@ -230,25 +549,23 @@ class LLMClient:
         while attempts < self.max_retries:
             attempts += 1
             try:
-                if attempts == 1:
-                    # logger.info("开始调用LLM API生成答案")
-                    pass
-                else:
+                if attempts > 1:
                     logger.info(
                         f"重试调用LLM API生成答案 (第 {attempts-1}/{self.max_retries-1} 次重试)")
 
-                # 使用OpenAI SDK调用API
-                response = self.client.chat.completions.create(
-                    model=os.getenv("MODEL_NAME", "deepseek-chat"),
-                    messages=[
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.8,
-                    max_tokens=20000  # 答案生成用更多的tokens以支持详尽回答
-                )
+                if self._batcher is not None:
+                    # 与其他并发请求合并发送，等待期间不阻塞事件循环
+                    answer = await asyncio.wrap_future(self._batcher.submit(prompt))
+                else:
+                    response = await session.chat.completions.create(
+                        model=os.getenv("MODEL_NAME", "deepseek-chat"),
+                        messages=self._build_messages(prompt, cache_prefix),
+                        temperature=0.8,
+                        max_tokens=20000  # 答案生成用更多的tokens以支持详尽回答
+                    )
 
-                # 获取响应文本
-                answer = response.choices[0].message.content.strip()
+                    # 获取响应文本
+                    answer = response.choices[0].message.content.strip()
 
                 if answer:
                     logger.info(f"成功生成答案，长度: {len(answer)} 字符")
@@ -263,31 +580,57 @@ class LLMClient:
 
                 wait_time = self.retry_delay * (attempts-1)
                 logger.info(f"将在 {wait_time} 秒后进行重试")
-                time.sleep(wait_time)
+                await asyncio.sleep(wait_time)
 
         logger.error(f"经过 {self.max_retries} 次尝试后，仍然无法成功生成答案")
         return ""
 
-    def _validate_qa_pairs(self, qa_pairs):
+    async def agenerate_answers_batch(self, session, prompt, num_answers, cache_prefix=None):
         """
-        验证问答对格式并进行必要的修复
+        在一次请求中为多个问题生成答案（异步版本）
 
         Args:
-            qa_pairs (list): 问答对列表
+            session (AsyncOpenAI): async_session创建的异步客户端
+            prompt (str): 完整的提示词（包含问题列表和文档内容）
+            num_answers (int): 问题数量
+            cache_prefix (str): 同一文档各请求共用的提示词前缀（可选，用于提示词缓存）
 
         Returns:
-            list: 验证后的问答对列表
+            list: 与问题顺序一一对应的答案列表，缺失的答案为空字符串
         """
-        valid_pairs = []
+        attempts = 0
+        while attempts < self.max_retries:
+            attempts += 1
+            try:
+                if attempts > 1:
+                    logger.info(
+                        f"重试调用LLM API批量生成答案 (第 {attempts-1}/{self.max_retries-1} 次重试)")
 
-        for qa in qa_pairs:
-            # 检查基本字段
-            if not isinstance(qa, dict):
-                continue
+                response = await session.chat.completions.create(
+                    model=os.getenv("MODEL_NAME", "deepseek-chat"),
+                    messages=self._build_messages(prompt, cache_prefix),
+                    temperature=0.8,
+                    max_tokens=20000
+                )
 
-            if 'question' not in qa or 'answer' not in qa:
-                continue
+                # 获取响应文本并按问题序号解析答案
+                answers = self._parse_batch_answers(
+                    response.choices[0].message.content, num_answers)
+                if answers is None:
+                    continue
+
+                logger.info(
+                    f"成功批量生成答案 {sum(1 for a in answers if a)}/{num_answers} 个")
+                return answers
+
+            except Exception as e:
+                logger.error(f"调用LLM API批量生成答案时出错: {str(e)}")
+                if attempts >= self.max_retries:
+                    break
 
-            valid_pairs.append(qa)
+                wait_time = self.retry_delay * (attempts-1)
+                logger.info(f"将在 {wait_time} 秒后进行重试")
+                await asyncio.sleep(wait_time)
 
-        return valid_pairs
+        logger.error(f"经过 {self.max_retries} 次尝试后，仍然无法批量生成答案")
+        return [""] * num_answers
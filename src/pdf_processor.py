@@ -2,59 +2,251 @@
 # -*- coding: utf-8 -*-
 
 import os
+import io
 import logging
 import re
-import io
+import threading
+import queue
+import time
 import numpy as np
 from PIL import Image
-import PyPDF2
-import pdfplumber
 import fitz  # PyMuPDF
-from pix2tex.cli import LatexOCR
 from munch import Munch
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from .latex_cache import LatexCache
 
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 公式检测用到的正则，模块加载时编译一次
+_RE_CJK = re.compile(r'[\u4e00-\u9fff]')
+_RE_ENG = re.compile(r'\b[a-zA-Z]{3,}\b')
+_RE_MATH_SYMBOLS = re.compile(r'[∫∑∏√±×÷≠≈≤≥∞∂∇∈∉⊂⊃∪∩∧∨¬⊕⊗αβγδεζηθικλμνξοπρστυφχψω]')
+_RE_MATH_OP = re.compile(r'[+\-*/=^_(){}\[\]<>]')
+_RE_DIGIT = re.compile(r'\d')
+_RE_NUMPAGE = re.compile(r'[\d\.\s]+')
+# 文本清理用到的正则
+# 除换行以外的所有空白（含\r、不间断空格、全角空格等）
+_RE_HSPACE = re.compile(r'[^\S\n]+')
+# 三个及以上换行（中间允许夹着只剩一个空格的空行，空白已先被_RE_HSPACE压缩）
+_RE_MULTI_NEWLINE = re.compile(r'\n(?: ?\n){2,}')
+
+
+def _bbox_distance(a, b):
+    """两个矩形区域各坐标差的绝对值之和，用于匹配公式与文本块"""
+    return sum(abs(x - y) for x, y in zip(a, b))
+
+
+# 进程内共享的LatexOCR模型：按(配置, 权重, 是否禁用CUDA)缓存，
+# 无论创建多少个PDFProcessor，同一组参数的模型权重只加载一份。
+# torch和pix2tex只在加载模型和推理时导入，只做版面分析的spawn子进程不承担其导入开销
+_LATEX_OCR_CACHE = {}
+_LATEX_OCR_LOCK = threading.Lock()
+_LATEX_OCR_INFER_LOCK = threading.Lock()
+
+# LatexOCR默认参数
+_DEFAULT_LATEX_ARGS = {
+    'config': 'settings/config.yaml',
+    'checkpoint': 'checkpoints/weights.pth',
+    'no_cuda': False,  # 设置为False以启用CUDA
+    'no_resize': False
+}
+
+
+def get_shared_latex_ocr(args):
+    """
+    获取进程内共享的LatexOCR模型，首次调用时加载（线程安全）
+
+    Args:
+        args (Munch): LatexOCR参数
+
+    Returns:
+        LatexOCR: 模型实例
+    """
+    key = (args.config, args.checkpoint, args.no_cuda)
+    ocr = _LATEX_OCR_CACHE.get(key)
+    if ocr is None:
+        with _LATEX_OCR_LOCK:
+            ocr = _LATEX_OCR_CACHE.get(key)
+            if ocr is None:
+                logger.info("正在加载LatexOCR模型...")
+                import torch
+                from pix2tex.cli import LatexOCR
+                # 公式裁剪图尺寸反复出现，让cuDNN为每种输入尺寸自动选择最快的卷积实现
+                torch.backends.cudnn.benchmark = True
+                root_logger = logging.getLogger()
+                original_level = root_logger.level
+                ocr = LatexOCR(args)
+                root_logger.setLevel(original_level)
+                ocr.model.eval()
+                # GPU上使用半精度推理，CPU不支持高效的FP16运算，保持FP32
+                if ocr.args.device.startswith('cuda'):
+                    ocr.model.half()
+                _LATEX_OCR_CACHE[key] = ocr
+                logger.info(f"LatexOCR模型加载完成 (设备: {ocr.args.device})")
+    return ocr
+
+
+class _FormulaOCRWorker:
+    """公式识别消费线程：从队列中收集多个调用方提交的公式图像，凑批后统一推理"""
+
+    # 单次从队列取出的最大图像数（批内再按尺寸分桶、按formula_batch_size切分）
+    DRAIN_SIZE = 64
+    # 有多个提交方时，凑批等待更多图像的默认最长时间（秒）
+    DRAIN_TIMEOUT = 0.05
+    # 队列中的停止标记
+    _STOP = object()
+
+    def __init__(self, infer_fn, max_pending=256, drain_timeout=None):
+        """
+        初始化并启动识别线程
+
+        Args:
+            infer_fn: 批量识别函数，输入图像列表，返回等长的LaTeX字符串列表
+            max_pending (int): 队列容量，队列满时提交方阻塞，避免待识别图像占满内存
+            drain_timeout (float): 多个提交方时凑批的等待时间（秒），为None时使用DRAIN_TIMEOUT
+        """
+        self._infer = infer_fn
+        self._queue = queue.Queue(maxsize=max_pending)
+        self.drain_timeout = self.DRAIN_TIMEOUT if drain_timeout is None else drain_timeout
+        # 当前正在提交图像的调用方数量，只有一个时没有其他图像可等，不必等待凑批
+        self._producers = 0
+        self._producers_lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name="FormulaOCR", daemon=True)
+        self._thread.start()
+
+    @contextmanager
+    def producer(self):
+        """登记一个提交方，在with块内提交图像并等待结果"""
+        with self._producers_lock:
+            self._producers += 1
+        try:
+            yield self
+        finally:
+            with self._producers_lock:
+                self._producers -= 1
+
+    def submit(self, img):
+        """
+        提交一张公式图像
+
+        Args:
+            img: PIL图像
+
+        Returns:
+            Future: 结果为LaTeX字符串
+        """
+        future = Future()
+        self._queue.put((img, future))
+        return future
+
+    def _drain(self):
+        """
+        阻塞等待第一张图像，再尽量多取一些凑成一批：
+        只有一个提交方时只取队列中已有的图像，多个提交方时在drain_timeout内等待其他提交方
+
+        Returns:
+            list: (图像, Future)元组列表，收到停止标记时最后一个元素为_STOP
+        """
+        items = [self._queue.get()]
+        timeout = self.drain_timeout if self._producers > 1 else 0
+        deadline = time.monotonic() + timeout
+        while len(items) < self.DRAIN_SIZE and items[-1] is not self._STOP:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    items.append(self._queue.get(timeout=remaining))
+                else:
+                    items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def close(self):
+        """处理完已提交的图像后停止识别线程"""
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            items = self._drain()
+            stop = items[-1] is self._STOP
+            if stop:
+                items.pop()
+            if items:
+                self._run_batch(items)
+            if stop:
+                return
+
+    def _run_batch(self, items):
+        """识别一批图像并设置各自Future的结果"""
+        try:
+            results = self._infer([img for img, _ in items])
+        except Exception as e:
+            for _, future in items:
+                future.set_exception(e)
+            return
+        for (_, future), latex in zip(items, results):
+            future.set_result(latex)
+
 
 class PDFProcessor:
     """增强型PDF处理类，支持文本、结构和公式提取"""
 
-    def __init__(self, pdf_dir, use_latex_ocr=True):
+    # 批量提取时每个进程池任务处理的最大页数，页数更多的文档按页码区间拆成多个任务并行处理
+    PAGE_RANGE_SIZE = 16
+
+    def __init__(self, pdf_dir, use_latex_ocr=True, latex_cache_dir=None, formula_zoom=2.0,
+                 formula_batch_size=8):
         """
         初始化PDF处理器
 
         Args:
             pdf_dir (str): PDF文件所在的目录路径
             use_latex_ocr (bool): 是否使用LatexOCR处理公式
+            latex_cache_dir (str): 公式识别结果的磁盘缓存目录，为None时仅在内存中缓存
+            formula_zoom (float): 公式区域渲染的缩放倍数，越小渲染越快
+            formula_batch_size (int): 公式OCR单次前向推理的最大图像数
         """
         self.pdf_dir = pdf_dir
         self.use_latex_ocr = use_latex_ocr
+        self.formula_zoom = formula_zoom
+        # 渲染矩阵只构造一次，所有公式裁剪共用
+        self._formula_matrix = fitz.Matrix(formula_zoom, formula_zoom)
+        self.formula_batch_size = max(1, formula_batch_size)
         self.latex_ocr = None
+        self._latex_cache = LatexCache(latex_cache_dir)
+        # 模型在进程内共享，推理锁也必须共享：LatexOCR底层为CUDA模型，非线程安全，推理需串行执行
+        self._ocr_lock = _LATEX_OCR_INFER_LOCK
+        # 公式识别线程：各线程提交的公式图像汇总到队列，由单个线程凑批推理
+        self._ocr_worker = None
+        self._ocr_worker_lock = threading.Lock()
+
+        # LatexOCR模型延迟到第一次遇到公式候选时再加载，纯文本PDF不必承担模型加载开销
+        self._latex_args = Munch(_DEFAULT_LATEX_ARGS)
+
+        logger.info(f"增强型PDF处理器初始化，目录: {pdf_dir}, 公式OCR: {self.use_latex_ocr}")
+
+    def _get_latex_ocr(self):
+        """
+        获取LatexOCR模型，首次调用时加载（线程安全）
 
-        # 如果启用了LaTeX OCR，就初始化模型
-        if self.use_latex_ocr:
+        Returns:
+            LatexOCR: 模型实例，加载失败或未启用时返回None
+        """
+        if self.latex_ocr is None and self.use_latex_ocr:
             try:
-                logger.info("正在加载LatexOCR模型...")
-                arguments = Munch({
-                    'config': 'settings/config.yaml',
-                    'checkpoint': 'checkpoints/weights.pth',
-                    'no_cuda': False,  # 设置为False以启用CUDA
-                    'no_resize': False
-                })
-                root_logger = logging.getLogger()
-                original_level = root_logger.level
-                self.latex_ocr = LatexOCR(arguments)
-                root_logger.setLevel(original_level)
-                logger.info("LatexOCR模型加载完成")
+                self.latex_ocr = get_shared_latex_ocr(self._latex_args)
             except Exception as e:
                 logger.error(f"加载LatexOCR模型失败: {str(e)}")
                 self.use_latex_ocr = False
                 logging.getLogger().setLevel(logging.INFO)
-
-        logger.info(f"增强型PDF处理器初始化，目录: {pdf_dir}, 公式OCR: {self.use_latex_ocr}")
+        return self.latex_ocr
 
     def get_pdf_files(self):
         """
@@ -63,13 +255,12 @@ class PDFProcessor:
         Returns:
             list: PDF文件绝对路径列表
         """
-        pdf_files = []
         try:
             normalized_dir = os.path.abspath(os.path.normpath(self.pdf_dir))
-            for file in os.listdir(normalized_dir):
-                if file.lower().endswith('.pdf'):
-                    abs_path = os.path.abspath(os.path.join(normalized_dir, file))
-                    pdf_files.append(abs_path)
+            # 目录为绝对路径时，DirEntry.path即为绝对路径，无需再拼接
+            with os.scandir(normalized_dir) as it:
+                pdf_files = [entry.path for entry in it
+                             if entry.name.lower().endswith('.pdf') and entry.is_file()]
             logger.info(f"找到 {len(pdf_files)} 个PDF文件")
             return pdf_files
         except Exception as e:
@@ -86,70 +277,70 @@ class PDFProcessor:
         Returns:
             bool: 是否可能是公式
         """
-        if "lines" not in block:
+        lines = block.get("lines")
+        if not lines:
             return False
 
-        # 提取块中的所有文本
-        block_text = ""
-        for line in block["lines"]:
-            for span in line.get("spans", []):
-                block_text += span.get("text", "")
-
-        # 去除空白
-        block_text = block_text.strip()
+        # 先做O(1)的几何与行数过滤，绝大多数正文块在这里就被排除，无需拼接文本
+        # 检查区域尺寸（公式通常比较紧凑）
+        bbox = block.get("bbox", (0, 0, 0, 0))
+        width = bbox[2] - bbox[0]
+        height = bbox[3] - bbox[1]
 
-        # 基本过滤条件
-        if not block_text:
+        # 避免除零；公式通常宽度不会太大（排除表格标题等）
+        if height == 0 or width > 400:
             return False
 
-        # 如果文本太长（超过200字符），很可能不是公式
-        if len(block_text) > 200:
+        # 行数较多的块基本是正文段落（行间公式通常只占1-3行）
+        if len(lines) > 3:
             return False
 
-        # 如果是纯中文或纯英文段落，不是公式
-        chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', block_text))
-        english_words = len(re.findall(r'\b[a-zA-Z]{3,}\b', block_text))
+        # 单次遍历所有span，同时收集文本和字体大小
+        # 中文字符超过4个时很可能是正文，立即返回
+        texts = []
+        min_size = max_size = None
+        chinese_chars = 0
+        for line in lines:
+            for span in line.get("spans", ()):
+                text = span.get("text", "")
+                chinese_chars += len(_RE_CJK.findall(text))
+                if chinese_chars > 4:
+                    return False
+                texts.append(text)
+                # 只记录字体大小的最小值和最大值，无需保存完整列表
+                size = span.get("size", 0)
+                if min_size is None:
+                    min_size = max_size = size
+                elif size < min_size:
+                    min_size = size
+                elif size > max_size:
+                    max_size = size
+
+        # 去除空白
+        block_text = "".join(texts).strip()
 
-        # 如果中文字符超过4个，很可能是正文
-        if chinese_chars > 4:
+        # 文本为空或太短、太长（超过200字符）的块，很可能不是公式
+        if len(block_text) < 2 or len(block_text) > 200:
             return False
 
         # 如果英文单词超过5个，很可能是正文
-        if english_words > 5:
-            return False
+        english_words = 0
+        for _ in _RE_ENG.finditer(block_text):
+            english_words += 1
+            if english_words > 5:
+                return False
 
         # 检查是否包含数学符号或特殊字符
-        math_symbols = r'[∫∑∏√±×÷≠≈≤≥∞∂∇∈∉⊂⊃∪∩∧∨¬⊕⊗αβγδεζηθικλμνξοπρστυφχψω]'
-        has_math_symbols = bool(re.search(math_symbols, block_text))
+        has_math_symbols = bool(_RE_MATH_SYMBOLS.search(block_text))
 
         # 检查是否包含常见的数学运算符和数字组合
-        has_math_pattern = bool(re.search(r'[+\-*/=^_(){}\[\]<>]', block_text)) and \
-            bool(re.search(r'\d', block_text))
+        has_math_pattern = bool(_RE_MATH_OP.search(block_text)) and \
+            bool(_RE_DIGIT.search(block_text))
 
         # 检查字体大小差异（公式常有上下标）
-        font_sizes = []
-        for line in block["lines"]:
-            for span in line.get("spans", []):
-                font_sizes.append(span.get("size", 0))
-
         # 如果有明显的字体大小变化（上下标），可能是公式
-        has_size_variation = len(set(font_sizes)) > 1 and max(
-            font_sizes) - min(font_sizes) > 2
-
-        # 检查宽高比（公式通常比较紧凑）
-        bbox = block.get("bbox", (0, 0, 0, 0))
-        width = bbox[2] - bbox[0]
-        height = bbox[3] - bbox[1]
-
-        # 避免除零
-        if height == 0:
-            return False
-
-        aspect_ratio = width / height
-
-        # 公式通常宽度不会太大（排除表格标题等）
-        if width > 400:
-            return False
+        # （能走到这里说明文本非空，至少有一个span，min_size/max_size已赋值）
+        has_size_variation = max_size - min_size > 2
 
         # 综合判断
         # 必须满足以下条件之一：
@@ -163,35 +354,32 @@ class PDFProcessor:
         if has_math_pattern and has_size_variation:
             return True
 
-        if len(block["lines"]) <= 2 and has_math_pattern:
+        if len(lines) <= 2 and has_math_pattern:
             # 额外检查：确保不是普通的编号或页码
-            if not re.match(r'^[\d\.\s]+$', block_text):
+            if not _RE_NUMPAGE.fullmatch(block_text):
                 return True
 
         return False
 
-    def _detect_and_extract_formulas(self, doc, page_num):
+    def _detect_and_extract_formulas_from_blocks(self, page, blocks):
         """
-        检测并提取页面中的公式
+        检测页面中的公式区域并渲染为图像（不做OCR，由_batch_latex_ocr统一批量识别）
 
         Args:
-            doc: PyMuPDF文档对象
-            page_num: 页码
+            page: PyMuPDF页面对象
+            blocks: 该页面"dict"结构中的blocks，与纯文本提取共用
 
         Returns:
-            list: 公式列表，每个元素是(bbox, latex)元组
+            list: 公式候选列表，每个元素是(bbox, PIL.Image, 缓存键字节)元组
         """
-        if not self.use_latex_ocr or self.latex_ocr is None:
+        if not self.use_latex_ocr:
             return []
 
-        formulas = []
-        page = doc[page_num]
-
-        # 使用PyMuPDF检测可能是公式的区域
-        blocks = page.get_text("dict")["blocks"]
+        candidates = []
 
         for block in blocks:
-            if "lines" not in block:
+            # 跳过图片块
+            if block.get("type", 0) != 0 or "lines" not in block:
                 continue
 
             # 使用更智能的公式检测
@@ -209,142 +397,332 @@ class PDFProcessor:
             x1 = min(page.rect.width, x1 + margin)
             y1 = min(page.rect.height, y1 + margin)
 
-            # 渲染区域为图像
+            # 渲染区域为图像，直接使用原始像素构造PIL图像，省去PNG编码/解码
             pix = page.get_pixmap(
-                clip=(x0, y0, x1, y1), matrix=fitz.Matrix(2, 2))
-            img_bytes = pix.tobytes("png")
-            img = Image.open(io.BytesIO(img_bytes))
-            # logger.info(f"准备OCR识别公式，图像大小: {img.size}")
-
-            # 使用LatexOCR识别公式
-            try:
-                latex = self.latex_ocr(img)
-                if latex and len(latex) > 5:  # 确保有意义的输出
-                    formulas.append((bbox, latex))
-                    # logger.info(f"✓ 成功识别公式: {latex[:50]}...")
-            except Exception as e:
-                logger.debug(f"公式识别失败: {str(e)}")
-                continue
+                clip=(x0, y0, x1, y1), matrix=self._formula_matrix, alpha=False)
+            # pix.samples每次访问都会复制一份像素，只取一次
+            samples = pix.samples
+            img = Image.frombuffer("RGB", (pix.width, pix.height), samples, "raw", "RGB", 0, 1)
+            # 在提取所在的进程中计算缓存键摘要，回传主进程时不必再附带一份像素
+            cache_key = LatexCache.make_key(pix.width, pix.height, samples)
+            candidates.append((bbox, img, cache_key))
 
-        return formulas
+        return candidates
 
-    def _process_with_pdfplumber(self, pdf_path):
+    def _prepare_formula_tensor(self, ocr, img):
         """
-        使用pdfplumber提取文本
+        按LatexOCR.__call__的方式预处理公式图像（填充、缩放、image_resizer自适应宽度）
 
         Args:
-            pdf_path: PDF文件路径
+            ocr: LatexOCR模型实例
+            img: PIL图像
 
         Returns:
-            str: 提取的文本
+            torch.Tensor: 形状为(1, 1, H, W)的输入张量
         """
-        text = ""
-        try:
-            # 确保使用绝对路径
-            abs_pdf_path = os.path.abspath(pdf_path)
-            with pdfplumber.open(abs_pdf_path) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text(x_tolerance=1, y_tolerance=3)
-                    if page_text:
-                        text += page_text + "\n"
-            return text
-        except Exception as e:
-            logger.error(f"使用pdfplumber提取文本失败: {str(e)}")
-            return ""
-
-    def _process_with_pymupdf(self, pdf_path):
+        from pix2tex import utils as latex_utils
+        from pix2tex.cli import minmax_size
+        from pix2tex.dataset.transforms import test_transform
+
+        args = ocr.args
+        img = minmax_size(latex_utils.pad(img), args.max_dimensions, args.min_dimensions)
+
+        if ocr.image_resizer is None or args.no_resize:
+            img = np.array(latex_utils.pad(img).convert('RGB'))
+            return test_transform(image=img)['image'][:1].unsqueeze(0)
+
+        input_image = img.convert('RGB').copy()
+        r, w, h = 1, input_image.size[0], input_image.size[1]
+        for _ in range(10):
+            h = int(h * r)
+            resample = Image.Resampling.BILINEAR if r > 1 else Image.Resampling.LANCZOS
+            img = latex_utils.pad(minmax_size(
+                input_image.resize((w, h), resample), args.max_dimensions, args.min_dimensions))
+            t = test_transform(image=np.array(img.convert('RGB')))['image'][:1].unsqueeze(0)
+            w = (ocr.image_resizer(t.to(args.device)).argmax(-1).item() + 1) * 32
+            if w == img.size[0]:
+                break
+            r = w / img.size[0]
+        return t
+
+    def _batch_latex_ocr(self, images):
         """
-        使用PyMuPDF提取结构化内容
+        批量识别公式图像。预处理后按张量尺寸分组，每组按formula_batch_size切分后批量调用model.generate
 
         Args:
-            pdf_path: PDF文件路径
+            images (list): PIL图像列表
 
         Returns:
-            tuple: (结构化文本, 公式列表)
+            list: 与输入一一对应的LaTeX字符串列表，识别失败的位置为空字符串
         """
-        structured_text = ""
-        all_formulas = []
+        results = [""] * len(images)
+        if not images:
+            return results
+
+        ocr = self._get_latex_ocr()
+        if ocr is None:
+            return results
+
+        import torch
+        from pix2tex import utils as latex_utils
+
+        args = ocr.args
+        use_cuda = args.device.startswith('cuda')
+        model_dtype = next(ocr.model.parameters()).dtype
+        with self._ocr_lock, torch.inference_mode(), \
+                torch.autocast(device_type='cuda', dtype=torch.float16, enabled=use_cuda):
+            # 尺寸相同的张量才能直接堆叠，按(H, W)分桶
+            buckets = {}
+            for idx, img in enumerate(images):
+                try:
+                    t = self._prepare_formula_tensor(ocr, img)
+                except Exception as e:
+                    logger.debug(f"公式图像预处理失败: {str(e)}")
+                    continue
+                buckets.setdefault(tuple(t.shape[2:]), []).append((idx, t))
+
+            batch_size = self.formula_batch_size
+            batches = [bucket[i:i + batch_size]
+                       for bucket in buckets.values()
+                       for i in range(0, len(bucket), batch_size)]
+            for items in batches:
+                try:
+                    batch = torch.cat([t for _, t in items]).to(args.device, dtype=model_dtype)
+                    dec = ocr.model.generate(
+                        batch, temperature=args.get('temperature', .25))
+                    preds = latex_utils.token2str(dec, ocr.tokenizer)
+                except Exception as e:
+                    logger.debug(f"公式批量识别失败: {str(e)}")
+                    continue
+                for (idx, _), pred in zip(items, preds):
+                    results[idx] = latex_utils.post_process(pred)
 
-        try:
-            # 确保使用绝对路径（PyMuPDF对路径格式更敏感）
-            abs_pdf_path = os.path.abspath(pdf_path)
-            # 打开PDF文档
-            doc = fitz.open(abs_pdf_path)
+        return results
+
+    def _get_ocr_worker(self):
+        """
+        获取本处理器的公式识别线程，首次调用时启动（线程安全）
 
-            for page_num in range(len(doc)):
-                page = doc[page_num]
+        Returns:
+            _FormulaOCRWorker: 公式识别线程
+        """
+        if self._ocr_worker is None:
+            with self._ocr_worker_lock:
+                if self._ocr_worker is None:
+                    self._ocr_worker = _FormulaOCRWorker(self._batch_latex_ocr)
+        return self._ocr_worker
+
+    def close(self):
+        """停止公式识别线程（如已启动）"""
+        with self._ocr_worker_lock:
+            if self._ocr_worker is not None:
+                self._ocr_worker.close()
+                self._ocr_worker = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _process_one_page(self, doc, page_num):
+        """
+        处理单个页面：提取文本块并检测公式候选区域
 
-                # 提取普通文本
-                page_text = page.get_text("text")
+        Args:
+            doc: PyMuPDF文档对象
+            page_num: 页码
 
-                # 检测并提取公式
-                formulas = self._detect_and_extract_formulas(doc, page_num)
-                all_formulas.extend([(page_num, *formula)
-                                    for formula in formulas])
+        Returns:
+            tuple: (页码, 文本块列表, 公式候选列表)，文本块为(bbox, 文本)元组
+        """
+        page = doc[page_num]
 
-                # 添加页面文本
-                structured_text += page_text + "\n"
+        # 只做一次版面分析和一次"dict"提取，文本块和公式检测共用（不排序以减少开销）
+        textpage = page.get_textpage(flags=fitz.TEXTFLAGS_TEXT)
+        dict_blocks = textpage.extractDICT(sort=False)["blocks"]
 
-            return structured_text, all_formulas
+        # 按块提取文本，保留每块的位置，供后续把公式插入到对应位置
+        # 每行的span拼接后以换行结尾，与get_text("blocks")的块文本一致
+        blocks = []
+        formula_blocks = []
+        for b in dict_blocks:
+            if b.get("type", 0) != 0 or not b.get("lines"):
+                continue
+            text = "".join("".join(span["text"] for span in line["spans"]) + "\n"
+                           for line in b["lines"])
+            blocks.append((tuple(b["bbox"]), text))
+            # 公式块本身必须含数学符号或“运算符+数字”（_is_likely_formula的必要条件），
+            # 用已拼接好的块文本先做这一廉价检查，不满足的块不再进入几何和字体分析
+            if _RE_MATH_SYMBOLS.search(text) or (
+                    _RE_MATH_OP.search(text) and _RE_DIGIT.search(text)):
+                formula_blocks.append(b)
+
+        # 检测公式候选区域，没有可能含公式的块时整页跳过
+        candidates = []
+        if formula_blocks:
+            candidates = self._detect_and_extract_formulas_from_blocks(page, formula_blocks)
+
+        return page_num, blocks, candidates
+
+    def _process_with_pymupdf(self, doc):
+        """
+        使用PyMuPDF提取结构化内容（只做版面分析和公式候选检测）
+        PyMuPDF不是线程安全的，同一文档的页面逐页顺序处理，并行由外层的进程池提供
+
+        Args:
+            doc: 已打开的PyMuPDF文档对象
+
+        Returns:
+            tuple: (按页码排列的文本块列表, 公式候选列表)，公式候选为(页码, bbox, 图像, 缓存键)元组
+        """
+        try:
+            page_results = [self._process_one_page(doc, page_num)
+                            for page_num in range(len(doc))]
+            return self._collect_page_results(page_results)
         except Exception as e:
             logger.error(f"使用PyMuPDF提取结构化内容失败: {str(e)}")
-            return "", []
+            return [], []
 
-    def _integrate_content(self, basic_text, structured_text, formulas):
+    def _process_page_range(self, pdf_path, start, end=None):
         """
-        整合不同来源的内容，确保文本连贯，公式位于正确位置
+        在当前进程中打开文档并顺序处理[start, end)区间内的页面
 
         Args:
-            basic_text: 基本文本
-            structured_text: 结构化文本
-            formulas: 公式列表
+            pdf_path (str): PDF文件绝对路径
+            start (int): 起始页码
+            end (int): 结束页码（不含），为None时处理到最后一页
 
         Returns:
-            str: 整合后的最终文本
+            tuple: (元数据（仅start为0时读取，否则为None）, (页码, 文本块列表, 公式候选列表)元组的列表)
+        """
+        with fitz.open(pdf_path) as doc:
+            metadata = self._read_metadata(doc) if start == 0 else None
+            end = len(doc) if end is None else min(end, len(doc))
+            return metadata, [self._process_one_page(doc, page_num)
+                              for page_num in range(start, end)]
+
+    @staticmethod
+    def _read_metadata(doc):
+        """
+        读取PDF元数据
+
+        Args:
+            doc: 已打开的PyMuPDF文档对象
+
+        Returns:
+            dict: 元数据
+        """
+        if not doc.metadata:
+            return {}
+        return {
+            "title": doc.metadata.get('title', ''),
+            "author": doc.metadata.get('author', ''),
+            "subject": doc.metadata.get('subject', ''),
+            "creator": doc.metadata.get('creator', ''),
+            "producer": doc.metadata.get('producer', '')
+        }
+
+    @staticmethod
+    def _collect_page_results(page_results):
         """
-        # 如果没有检测到公式，直接返回更好的文本版本
-        if not formulas:
-            return structured_text if structured_text else basic_text
+        将各页的处理结果按页码排序，拆分为按页文本块和带页码的公式候选
 
-        # 将公式按照页码和位置排序
-        formulas.sort(key=lambda x: (x[0], x[1][1]))  # 按页码和y坐标排序
+        Args:
+            page_results: (页码, 文本块列表, 公式候选列表)元组的列表
 
-        # 将公式插入到文本中适当位置
-        lines = structured_text.split('\n')
-        result = []
-        formula_idx = 0
+        Returns:
+            tuple: (按页码排列的文本块列表, 公式候选列表)，公式候选为(页码, bbox, 图像, 缓存键)元组
+        """
+        # 按页码恢复顺序
+        page_results.sort(key=lambda x: x[0])
 
-        # 假设每个公式应该插入在最近的文本段落后面
-        current_page = 0
+        page_blocks = []
+        all_candidates = []
+        for page_num, blocks, candidates in page_results:
+            all_candidates.extend([(page_num, *candidate)
+                                  for candidate in candidates])
+            page_blocks.append(blocks)
 
-        for i, line in enumerate(lines):
-            # 检查是否需要插入公式
-            result.append(line)
+        return page_blocks, all_candidates
 
-            if formula_idx < len(formulas):
-                formula_page, formula_bbox, formula_latex = formulas[formula_idx]
+    def _recognize_formulas(self, page_blocks, all_candidates):
+        """
+        识别公式候选（先查缓存，未命中的候选再跨页批量识别），并按页归类
 
-                if i < len(lines) - 1:
-                    next_line = lines[i + 1]
-                    if not next_line.strip():  # 如果下一行是空行，可能是段落结束
-                        if formula_page == current_page:
-                            # 在段落结束处插入公式
-                            result.append(f"[FORMULA: {formula_latex}]")
-                            formula_idx += 1
+        Args:
+            page_blocks: 按页码排列的文本块列表
+            all_candidates: 公式候选列表，元素为(页码, bbox, 图像, 缓存键)
 
-            # 估计当前页码
-            if not line.strip() and i > 0 and i < len(lines) - 1:
-                # 检测可能的页面变化
-                if lines[i - 1].strip() and lines[i + 1].strip():
-                    current_page += 1
+        Returns:
+            list: 按页码排列的(文本块列表, 公式列表)，公式为(bbox, latex)元组
+        """
+        pages = [(blocks, []) for blocks in page_blocks]
+
+        latex_list = [self._latex_cache.get(cache_key)
+                      for _, _, _, cache_key in all_candidates]
+        missing = [i for i, latex in enumerate(latex_list) if latex is None]
+        if missing:
+            # 提交给公式识别线程，与其他线程提交的公式一起凑批推理
+            with self._get_ocr_worker().producer() as worker:
+                futures = [worker.submit(all_candidates[i][2]) for i in missing]
+                for i, future in zip(missing, futures):
+                    try:
+                        latex = future.result()
+                    except Exception as e:
+                        logger.debug(f"公式识别失败: {str(e)}")
+                        latex = ""
+                    latex_list[i] = latex
+                    if latex:
+                        self._latex_cache.set(all_candidates[i][3], latex)
+
+        for (page_num, bbox, _, _), latex in zip(all_candidates, latex_list):
+            if latex and len(latex) > 5:  # 确保有意义的输出
+                pages[page_num][1].append((bbox, latex))
+
+        return pages
+
+    def _integrate_content(self, pages):
+        """
+        逐页将公式插入到其所在位置的文本块之后，再拼接所有页面
 
-        # 将剩余的公式添加到文档末尾
-        while formula_idx < len(formulas):
-            _, _, formula_latex = formulas[formula_idx]
-            result.append(f"[FORMULA: {formula_latex}]")
-            formula_idx += 1
+        Args:
+            pages: 按页码排列的(文本块列表, 公式列表)
 
-        return '\n'.join(result)
+        Returns:
+            str: 整合后的最终文本
+        """
+        buf = io.StringIO()
+        for page_num, (blocks, formulas) in enumerate(pages):
+            # 公式候选本身就是该页的一个文本块，按位置找最接近的文本块即可定位
+            attached = {}
+            for bbox, latex in sorted(formulas, key=lambda x: x[0][1]):  # 按y坐标排序
+                if blocks:
+                    idx = min(range(len(blocks)),
+                              key=lambda i: _bbox_distance(blocks[i][0], bbox))
+                else:
+                    idx = -1
+                attached.setdefault(idx, []).append(latex)
+
+            # 页内先写入单独的缓冲区，便于按页清理空白
+            page_buf = io.StringIO()
+            for idx, (_, text) in enumerate(blocks):
+                page_buf.write(text)
+                if not text.endswith('\n'):
+                    page_buf.write('\n')
+                for latex in attached.get(idx, ()):
+                    page_buf.write(f"[FORMULA: {latex}]\n")
+            for latex in attached.get(-1, ()):
+                page_buf.write(f"[FORMULA: {latex}]\n")
+
+            # 按页清理多余空白（保留换行，以免破坏段落结构）
+            page_text = _RE_HSPACE.sub(' ', page_buf.getvalue())  # 替换换行以外的连续空白为单个空格
+            page_text = _RE_MULTI_NEWLINE.sub('\n\n', page_text)  # 最多保留两个连续换行
+            if page_num:
+                buf.write('\n')
+            buf.write(page_text)
+
+        return buf.getvalue()
 
     def extract_text_from_pdf(self, pdf_path):
         """
@@ -362,55 +740,157 @@ class PDFProcessor:
             pdf_filename = os.path.basename(pdf_path)
             logger.info(f"开始增强处理PDF文件: {pdf_filename}")
 
-            # 使用PyPDF2提取基本文本
-            basic_text = ""
-            metadata = {}
+            layout = self._extract_layout(pdf_path)
+            final_text = self._build_text(pdf_filename, layout)
 
-            try:
-                reader = PyPDF2.PdfReader(pdf_path)
-                # 提取元数据
-                if reader.metadata:
-                    metadata = {
-                        "title": reader.metadata.get('/Title', ''),
-                        "author": reader.metadata.get('/Author', ''),
-                        "subject": reader.metadata.get('/Subject', ''),
-                        "creator": reader.metadata.get('/Creator', ''),
-                        "producer": reader.metadata.get('/Producer', '')
-                    }
-
-                # 提取文本
-                for page in reader.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        basic_text += page_text + "\n"
-            except Exception as e:
-                logger.error(f"使用PyPDF2提取文本失败: {str(e)}")
+            return final_text, pdf_filename, layout[0]
+        except Exception as e:
+            logger.error(f"从PDF文件 {pdf_path} 提取文本时出错: {str(e)}")
+            return "", os.path.basename(pdf_path), {}
+
+    def _extract_layout(self, pdf_path):
+        """
+        打开PDF并在当前进程中提取元数据、按页文本块和公式候选（不做公式识别）
 
-            # # 使用pdfplumber提取更精确的文本
-            # plumber_text = self._process_with_pdfplumber(pdf_path)
+        Args:
+            pdf_path (str): PDF文件绝对路径
 
-            # 使用PyMuPDF提取结构化文本和公式
+        Returns:
+            tuple: (元数据, 按页码排列的文本块列表, 公式候选列表)
+        """
+        # 元数据、文本和公式均来自同一个PyMuPDF文档对象
+        with fitz.open(pdf_path) as doc:
+            metadata = self._read_metadata(doc)
+            # 使用PyMuPDF提取结构化文本和公式候选
             logger.info("使用PyMuPDF提取结构化文本和公式")
-            structured_text, formulas = self._process_with_pymupdf(pdf_path)
+            page_blocks, candidates = self._process_with_pymupdf(doc)
+
+        return metadata, page_blocks, candidates
+
+    def _build_text(self, pdf_filename, layout):
+        """
+        识别公式并与文本块整合为最终文本
 
-            # 整合内容
-            final_text = self._integrate_content(
-                basic_text, structured_text, formulas)
+        Args:
+            pdf_filename (str): PDF文件名（用于日志）
+            layout (tuple): _extract_layout的返回值
+
+        Returns:
+            str: 整合后的最终文本
+        """
+        _, page_blocks, candidates = layout
+        pages = self._recognize_formulas(page_blocks, candidates)
 
-            # 后处理：清理文本中的特殊字符和多余空白
-            final_text = re.sub(r'\s+', ' ', final_text)  # 替换多个空白为单个空格
-            final_text = re.sub(
-                r'(\n\s*){3,}', '\n\n', final_text)  # 最多保留两个连续换行
+        # 整合内容
+        final_text = self._integrate_content(pages)
 
-            content_length = len(final_text)
-            formula_count = len(formulas)
+        content_length = len(final_text)
+        formula_count = sum(len(formulas) for _, formulas in pages)
+        logger.info(
+            f"成功从 {pdf_filename} 提取文本，共 {content_length} 个字符，检测到 {formula_count} 个公式")
+
+        return final_text
+
+    def _page_range_tasks(self, pdf_paths):
+        """
+        把PDF列表展开为页码区间任务：页数不超过PAGE_RANGE_SIZE的文档为一个任务，
+        更大的文档按页码区间拆分（只打开文档读取页数，不解析页面）
+
+        Args:
+            pdf_paths (list): PDF文件路径列表
+
+        Yields:
+            tuple: (PDF文件绝对路径, [(起始页码, 结束页码), ...])，结束页码为None表示到最后一页
+        """
+        for pdf_path in pdf_paths:
+            pdf_path = os.path.abspath(pdf_path)
+            try:
+                with fitz.open(pdf_path) as doc:
+                    page_count = len(doc)
+            except Exception as e:
+                # 交给子进程整体处理，由任务本身报告错误
+                logger.debug(f"读取PDF文件 {pdf_path} 的页数失败: {str(e)}")
+                yield pdf_path, [(0, None)]
+                continue
+
+            size = self.PAGE_RANGE_SIZE
+            if page_count <= size:
+                yield pdf_path, [(0, None)]
+                continue
+
+            ranges = [(start, min(start + size, page_count))
+                      for start in range(0, page_count, size)]
             logger.info(
-                f"成功从 {pdf_filename} 提取文本，共 {content_length} 个字符，检测到 {formula_count} 个公式")
+                f"文档 {os.path.basename(pdf_path)} 共 {page_count} 页，拆分为 {len(ranges)} 个页码区间并行提取")
+            yield pdf_path, ranges
 
-            return final_text, pdf_filename, metadata
-        except Exception as e:
-            logger.error(f"从PDF文件 {pdf_path} 提取文本时出错: {str(e)}")
-            return "", os.path.basename(pdf_path), {}
+    def iter_layouts(self, pdf_paths, max_workers=3):
+        """
+        使用进程池并行提取多个PDF的版面，按完成顺序逐个产出结果
+
+        PyMuPDF解析是CPU密集型且不会可靠地释放GIL，因此放到子进程中执行；进程数最多取4。
+        页数较多的文档拆分为多个页码区间任务，单个大文档也能用满所有进程。
+        使用spawn避免fork已初始化的CUDA上下文，公式识别统一在主进程中完成。
+        在途任务数不超过进程数的两倍，调用方消费变慢时不再提交新任务，峰值内存有界
+
+        Args:
+            pdf_paths (list): PDF文件路径列表
+            max_workers (int): 最大进程数
+
+        Yields:
+            tuple: (PDF文件绝对路径, _extract_layout格式的版面)，提取失败时版面为None
+        """
+        workers = max(1, min(max_workers, os.cpu_count() or 1, 4))
+        tasks = self._page_range_tasks(pdf_paths)
+        pending = []
+        # 各文档的汇总状态：剩余任务数、元数据、已完成的页面结果、是否出错
+        states = {}
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_layout_worker,
+                                 initargs=(self.pdf_dir, self.use_latex_ocr,
+                                           self.formula_zoom)) as executor:
+            in_flight = {}
+
+            def submit_next():
+                while not pending:
+                    item = next(tasks, None)
+                    if item is None:
+                        return
+                    pdf_path, ranges = item
+                    states[pdf_path] = {"remaining": len(ranges), "metadata": {},
+                                        "pages": [], "ok": True}
+                    pending.extend((pdf_path, start, end) for start, end in reversed(ranges))
+                pdf_path, start, end = pending.pop()
+                future = executor.submit(_extract_page_range_in_worker, pdf_path, start, end)
+                in_flight[future] = pdf_path
+
+            for _ in range(workers * 2):
+                submit_next()
+
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pdf_path = in_flight.pop(future)
+                    state = states[pdf_path]
+                    try:
+                        metadata, page_results = future.result()
+                        if metadata is not None:
+                            state["metadata"] = metadata
+                        state["pages"].extend(page_results)
+                    except Exception as e:
+                        logger.error(f"提取PDF文件 {pdf_path} 的版面时出错: {str(e)}")
+                        state["ok"] = False
+                    state["remaining"] -= 1
+                    submit_next()
+
+                    if state["remaining"] == 0:
+                        del states[pdf_path]
+                        layout = None
+                        if state["ok"]:
+                            layout = (state["metadata"],
+                                      *self._collect_page_results(state["pages"]))
+                        yield pdf_path, layout
 
     def extract_pdfs_to_txt(self, txt_dir, max_workers=3):
         """
@@ -450,58 +930,51 @@ class PDFProcessor:
         failed_count = 0
         failed_files = []
         
-        def process_single_pdf(pdf_path, txt_filepath):
-            """处理单个PDF文件"""
+        def save_single_pdf(pdf_path, txt_filepath, layout):
+            """识别公式、整合文本并保存单个PDF的txt文件"""
             pdf_filename = os.path.basename(pdf_path)
-            
-            # 检查txt文件是否已存在
-            if os.path.exists(txt_filepath):
-                logger.info(f"跳过已存在的文件: {txt_filepath}")
-                return 'skip', pdf_filename
-            
+
             try:
-                # 提取文本
-                content, _, metadata = self.extract_text_from_pdf(pdf_path)
-                
+                content = self._build_text(pdf_filename, layout)
+
                 if not content:
                     logger.warning(f"PDF文件 {pdf_filename} 没有提取到内容")
                     return 'failed', pdf_filename
-                
+
                 # 保存到txt文件
                 with open(txt_filepath, 'w', encoding='utf-8') as f:
                     f.write(content)
-                
+
                 logger.info(f"成功提取并保存: {txt_filepath} (长度: {len(content)} 字符)")
                 return 'success', pdf_filename
-                
+
             except Exception as e:
                 logger.error(f"处理PDF文件 {pdf_path} 时出错: {str(e)}", exc_info=True)
                 return 'failed', pdf_filename
-        
-        # 使用线程池并行处理
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有任务
-            future_to_pdf = {
-                executor.submit(process_single_pdf, pdf, txt): pdf for pdf, txt in zip(pdf_files, txt_files)
-            }
-            
-            # 收集结果
-            for future in as_completed(future_to_pdf):
-                pdf = future_to_pdf[future]
-                try:
-                    status, filename = future.result()
-                    if status == 'success':
-                        success_count += 1
-                    elif status == 'skip':
-                        skip_count += 1
-                    else:
-                        failed_count += 1
-                        failed_files.append(filename)
-                except Exception as e:
-                    logger.error(f"获取文件 {pdf} 的处理结果时出错: {str(e)}")
-                    failed_count += 1
-                    failed_files.append(os.path.basename(pdf))
-        
+
+        # 检查txt文件是否已存在
+        pending = {}
+        for pdf, txt in zip(pdf_files, txt_files):
+            if os.path.exists(txt):
+                logger.info(f"跳过已存在的文件: {txt}")
+                skip_count += 1
+            else:
+                pending[os.path.abspath(pdf)] = txt
+
+        # 版面在子进程中提取，公式识别和文本整合在主进程中完成
+        for pdf, layout in self.iter_layouts(list(pending), max_workers):
+            txt = pending[pdf]
+            if layout is None:
+                status, filename = 'failed', os.path.basename(pdf)
+            else:
+                status, filename = save_single_pdf(pdf, txt, layout)
+
+            if status == 'success':
+                success_count += 1
+            else:
+                failed_count += 1
+                failed_files.append(filename)
+
         # 打印统计信息
         logger.info(f"提取完成: 成功 {success_count}, 跳过 {skip_count}, 失败 {failed_count}")
         print(f"\n提取统计:")
@@ -517,3 +990,37 @@ class PDFProcessor:
         print(f"\n所有txt文件已保存到: {os.path.abspath(txt_dir)}")
         
         return success_count, skip_count, failed_count
+
+
+# 进程池子进程内的PDF处理器，由_init_layout_worker在每个子进程中创建一次
+_WORKER_PROCESSOR = None
+
+
+def _init_layout_worker(pdf_dir, use_latex_ocr, formula_zoom):
+    """
+    进程池子进程初始化：创建只做版面分析的PDF处理器（子进程中不会加载LatexOCR模型）
+
+    Args:
+        pdf_dir (str): PDF文件目录
+        use_latex_ocr (bool): 是否检测公式候选
+        formula_zoom (float): 公式区域渲染的缩放倍数
+    """
+    global _WORKER_PROCESSOR
+    _WORKER_PROCESSOR = PDFProcessor(pdf_dir, use_latex_ocr, None, formula_zoom)
+
+
+def _extract_page_range_in_worker(pdf_path, start, end):
+    """
+    子进程任务入口：提取单个PDF中[start, end)区间内页面的文本块和公式候选
+
+    Args:
+        pdf_path (str): PDF文件绝对路径
+        start (int): 起始页码
+        end (int): 结束页码（不含），为None时处理到最后一页
+
+    Returns:
+        tuple: (元数据（仅start为0时读取，否则为None）, (页码, 文本块列表, 公式候选列表)元组的列表)
+    """
+    if start == 0:
+        logger.info(f"开始增强处理PDF文件: {os.path.basename(pdf_path)}")
+    return _WORKER_PROCESSOR._process_page_range(pdf_path, start, end)
@@ -14,6 +14,126 @@ normal_level_prompt = """
 4. 问题难度应符合卫星互联网进阶知识领域，例如基础理论原理、技术方法、系统架构、性能分析、应用场景等，具备一定的挑战性；回答应当深入细致，逻辑链完整严谨，能够彻底回答这个问题，不能三言两语就能作答。
 """
 
+pro_answer_requirements_prompt = """【答案要求】：
+1. **长度要求**：答案应至少500-800字，确保内容充分详尽
+2. **内容结构**：
+   - 首先给出清晰的定义或概念说明
+   - 详细阐述理论原理和技术机制
+   - 如涉及数学模型，给出公式推导和参数说明
+   - 提供技术细节和实现要点
+   - 必要时给出实例说明或应用场景
+   - 说明与相关技术的关系或对比
+   - 直接给出答案，不要解释你是什么角色、基于什么文献。如果领域与卫星互联网无关，也直接作答，不要说"该领域与卫星互联网无关"。
+3. **专业性要求**：
+   - 使用准确的学术术语和技术词汇
+   - 体现专家级的深度理解
+   - 答案应成体系化，有清晰的逻辑层次
+4. **准确性要求**：
+   - 答案必须基于提供的文档内容
+   - 不要编造文档中不存在的信息
+   - 如果文档信息不足，说明已知部分即可
+"""
+
+class PreparedPrompt:
+    """
+    同一文档的答案生成提示词，包含文档内容的部分只格式化一次，
+    之后每个问题（或每批问题）只需拼接到前缀之后
+    """
+
+    def __init__(self, document_prefix, question_prefix, suffix):
+        """
+        Args:
+            document_prefix (str): 角色、答案要求和文档内容组成的公共前缀
+            question_prefix (str): 单个答案提示词的前缀（公共前缀 + 问题标题）
+            suffix (str): 单个答案提示词的后缀
+        """
+        self.document_prefix = document_prefix
+        self.prefix = question_prefix
+        self.suffix = suffix
+
+    def render(self, question):
+        """
+        生成单个问题的完整提示词
+
+        Args:
+            question (str): 问题内容
+
+        Returns:
+            str: 完整提示词
+        """
+        return self.prefix + question + self.suffix
+
+    def render_batch(self, questions):
+        """
+        生成一次回答多个问题的完整提示词
+
+        Args:
+            questions (list): 问题列表
+
+        Returns:
+            str: 完整提示词
+        """
+        return self.document_prefix + PromptTemplates.get_pro_batch_question_block(questions)
+
+    def for_questions(self, questions):
+        """
+        获取回答给定问题时实际使用的提示词（完整文档作为上下文时即为自身）
+
+        Args:
+            questions (list): 问题列表
+
+        Returns:
+            PreparedPrompt: 提示词
+        """
+        return self
+
+
+class RetrievalPreparedPrompt:
+    """
+    长文档的答案生成提示词：不发送完整文档，而是为每个问题（或每批问题）
+    检索最相关的若干文本块作为上下文。
+    与PreparedPrompt提供相同的render、render_batch和for_questions接口，但没有固定的前缀，
+    需要前缀时先通过for_questions取得实际使用的PreparedPrompt
+    """
+
+    def __init__(self, retriever, metadata=None, top_k=3):
+        """
+        Args:
+            retriever (ChunkRetriever): 该文档的文本块检索器
+            metadata (dict): PDF元数据（可选）
+            top_k (int): 每个问题选取的文本块数
+        """
+        self.retriever = retriever
+        self.metadata = metadata
+        self.top_k = top_k
+        # 同一问题在查缓存、生成、写缓存时会多次渲染，检索结果按问题元组缓存
+        self._prepared = {}
+
+    def for_questions(self, questions):
+        """
+        检索给定问题的相关文本块，生成以其为上下文的提示词（CPU密集，异步代码中应在线程中调用）
+
+        Args:
+            questions (list): 问题列表
+
+        Returns:
+            PreparedPrompt: 提示词
+        """
+        key = tuple(questions)
+        prepared = self._prepared.get(key)
+        if prepared is None:
+            context = "\n\n".join(self.retriever.top_chunks(list(questions), self.top_k))
+            prepared = self._prepared.setdefault(
+                key, PromptTemplates.prepare_pro_answer_prompt(context, self.metadata))
+        return prepared
+
+    def render(self, question):
+        return self.for_questions([question]).render(question)
+
+    def render_batch(self, questions):
+        return self.for_questions(questions).render_batch(questions)
+
+
 class PromptTemplates:
     """提示词模板类，用于生成各种提示词"""
 
@@ -63,50 +183,75 @@ class PromptTemplates:
 ]"""
 
     @staticmethod
-    def get_pro_answer_generation_prompt(question, content, metadata=None):
+    def get_pro_answer_document_prefix(content, metadata=None):
         """
-        生成单个答案的prompt模板
+        答案生成提示词中与问题无关的公共前缀（角色、答案要求、文档内容）
+        同一文档的所有答案请求（单个或批量）都以完全相同的前缀开头，问题放在最后，
+        便于服务端对前缀做提示词缓存，避免对同一文档内容重复预填充
 
         Args:
-            question (str): 问题内容
             content (str): 文档内容
             metadata (dict): PDF元数据（可选）
 
         Returns:
-            str: 格式化后的提示词
+            str: 公共前缀
         """
         return f"""
-你是一位卫星互联网领域的资深研究员和博士导师，需要针对以下问题，基于提供的学术文献内容，给出一个详尽、专业、体系化的答案。
+你是一位卫星互联网领域的资深研究员和博士导师，需要基于提供的学术文献内容，针对文末给出的问题，给出详尽、专业、体系化的答案。
 
 【角色定位】：
 你是卫星互联网领域的专家，精通卫星通信、信号处理、网络协议、轨道设计等相关技术。
 
-【问题】：
-{question}
-
-【答案要求】：
-1. **长度要求**：答案应至少500-800字，确保内容充分详尽
-2. **内容结构**：
-   - 首先给出清晰的定义或概念说明
-   - 详细阐述理论原理和技术机制
-   - 如涉及数学模型，给出公式推导和参数说明
-   - 提供技术细节和实现要点
-   - 必要时给出实例说明或应用场景
-   - 说明与相关技术的关系或对比
-   - 直接给出答案，不要解释你是什么角色、基于什么文献。如果领域与卫星互联网无关，也直接作答，不要说"该领域与卫星互联网无关"。
-3. **专业性要求**：
-   - 使用准确的学术术语和技术词汇
-   - 体现专家级的深度理解
-   - 答案应成体系化，有清晰的逻辑层次
-4. **准确性要求**：
-   - 答案必须基于提供的文档内容
-   - 不要编造文档中不存在的信息
-   - 如果文档信息不足，说明已知部分即可
-
+{pro_answer_requirements_prompt}
 【参考文档】：
 {content}
+"""
+
+    @staticmethod
+    def prepare_pro_answer_prompt(content, metadata=None):
+        """
+        为一个文档预先生成答案提示词，文档内容只格式化一次，供该文档的所有问题共用
+
+        Args:
+            content (str): 文档内容
+            metadata (dict): PDF元数据（可选）
+
+        Returns:
+            PreparedPrompt: 预生成的提示词
+        """
+        document_prefix = PromptTemplates.get_pro_answer_document_prefix(content, metadata)
+        prefix = document_prefix + """
+【问题】：
+"""
+        suffix = """
 
 请直接返回详细的答案内容（不需要JSON格式，直接返回答案文本）："""
+        return PreparedPrompt(document_prefix, prefix, suffix)
+
+    @staticmethod
+    def get_pro_batch_question_block(questions):
+        """
+        批量答案提示词中接在公共前缀之后的问题列表和输出格式部分
+
+        Args:
+            questions (list): 问题列表
+
+        Returns:
+            str: 问题列表部分
+        """
+        question_list = "\n".join(
+            f"{i}. {question}" for i, question in enumerate(questions, 1))
+        return f"""
+【问题列表】：
+{question_list}
+
+请分别回答以上{len(questions)}个问题，每个问题的答案必须独立完整，不要引用其他问题的答案。
+请仅返回JSON格式的答案列表，每个答案包含'id'（问题序号）和'answer'字段，按问题序号顺序排列：
+[
+  {{"id": 1, "answer": "问题1的详细答案"}},
+  {{"id": 2, "answer": "问题2的详细答案"}},
+  ...
+]"""
 
     @staticmethod
     def get_normal_qa_pair_generation_prompt(content, num_questions, metadata=None):
@@ -140,4 +285,4 @@ class PromptTemplates:
   {{"question": "问题1的具体内容", "answer": "答案1的具体内容"}},
   {{"question": "问题2的具体内容", "answer": "答案2的具体内容"}},
   ...
-]"""
\ No newline at end of file
+]"""
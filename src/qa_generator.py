@@ -3,12 +3,16 @@
 
 import os
 import logging
-import json
-import glob
+import time
+import asyncio
+import queue
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from .pdf_processor import PDFProcessor
 from .llm_client import LLMClient
-from .prompts import PromptTemplates
+from .prompts import PromptTemplates, RetrievalPreparedPrompt
+from .retrieval import ChunkRetriever
+from .cache import AnswerCache, content_scope
 
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -18,9 +22,18 @@ logger = logging.getLogger(__name__)
 class QAGenerator:
     """问答生成器类"""
 
+    # 提示词模板无状态，所有生成器共用一个实例
+    prompt_templates = PromptTemplates()
+
+    # 各模式下每个问题至少对应的文档字符数，不足一个问题的文档不调用API
+    CHARS_PER_QUESTION = {'pro': 2000, 'normal': 800}
+
     def __init__(self, pdf_dir="pdf_files", num_qa_pairs=20, max_workers=3,
                  api_max_retries=3, api_retry_delay=2,
-                 use_latex_ocr=True, answer_max_workers=5, excel_writer=None, mode='normal'):
+                 use_latex_ocr=True, answer_max_workers=5, excel_writer=None, mode='normal',
+                 latex_cache_dir=None, formula_zoom=2.0, formula_batch_size=8,
+                 answer_batch_size=1, answer_cache_dir=None, semantic_cache=False,
+                 answer_context_chunks=0):
         """
         初始化问答生成器
 
@@ -31,24 +44,113 @@ class QAGenerator:
             api_max_retries (int): API调用最大重试次数
             api_retry_delay (int): API调用重试间隔(秒)
             use_latex_ocr (bool): 是否使用LaTeX OCR
-            answer_max_workers (int): 答案生成的并行线程数（默认5）
+            answer_max_workers (int): 答案生成的最大并发请求数（默认5）
             excel_writer (ExcelWriter): Excel写入器实例，用于保存单个PDF结果
             mode (str): 模式: normal-正常模式生成大量较短的且相对常见基础的知识问答对, pro-专业模式生成少量但长篇的深入研讨问答对
+            latex_cache_dir (str): 公式识别结果的缓存目录
+            formula_zoom (float): 公式区域渲染的缩放倍数
+            formula_batch_size (int): 公式OCR单次前向推理的最大图像数
+            answer_batch_size (int): pro模式下单次请求生成答案的问题数（1为逐个生成）
+            answer_cache_dir (str): 答案缓存目录，为None时不缓存
+            semantic_cache (bool): 是否启用答案的语义相似匹配缓存
+            answer_context_chunks (int): pro模式下长文档每个问题检索的文本块数，
+                                         为0时始终以完整文档作为答案上下文
         """
-        self.pdf_processor = PDFProcessor(pdf_dir, use_latex_ocr)
+        self.pdf_processor = PDFProcessor(
+            pdf_dir, use_latex_ocr, latex_cache_dir, formula_zoom, formula_batch_size)
+        # 连接池覆盖所有文件线程同时发起的请求，避免超出池大小后反复新建连接
         self.llm_client = LLMClient(
-            max_retries=api_max_retries, retry_delay=api_retry_delay)
-        self.prompt_templates = PromptTemplates()  # 初始化提示词模板
+            max_retries=api_max_retries, retry_delay=api_retry_delay,
+            pool_size=max(32, max_workers * answer_max_workers))
         self.num_qa_pairs = num_qa_pairs
         self.max_workers = max_workers
         self.answer_max_workers = answer_max_workers
+        self.answer_batch_size = max(1, answer_batch_size)
+        self.answer_context_chunks = max(0, answer_context_chunks)
+        self.answer_cache = AnswerCache(
+            answer_cache_dir, semantic=semantic_cache) if answer_cache_dir else None
         self.excel_writer = excel_writer  # 用于保存单个PDF结果
         self.failed_files = []  # 用于记录处理失败的文件
         self.mode = mode
 
+        # 跨文档复用的执行环境，首次使用时创建，由close()关闭：
+        # 答案生成的事件循环线程及其异步客户端（连接池），以及txt文件处理线程池
+        self._loop = None
+        self._loop_thread = None
+        self._session = None
+        self._file_pool = None
+        self._runtime_lock = threading.Lock()
+
         logger.info(
             f"问答生成器初始化，目录: {pdf_dir}，每个PDF生成 {num_qa_pairs} 个问答对，答案生成并行数: {answer_max_workers}")
 
+    def _get_event_loop(self):
+        """
+        获取答案生成共用的事件循环，首次调用时在后台线程中启动并创建异步客户端（线程安全）
+
+        Returns:
+            asyncio.AbstractEventLoop: 事件循环
+        """
+        if self._loop is None:
+            with self._runtime_lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    self._loop_thread = threading.Thread(
+                        target=loop.run_forever, name="qa-answer-loop", daemon=True)
+                    self._loop_thread.start()
+
+                    async def open_session():
+                        return self.llm_client.async_session()
+
+                    self._session = asyncio.run_coroutine_threadsafe(
+                        open_session(), loop).result()
+                    self._loop = loop
+        return self._loop
+
+    def _run_async(self, coro):
+        """
+        在共用的事件循环中执行协程并阻塞等待结果，各文件线程提交的协程在同一循环中并发执行
+
+        Args:
+            coro: 协程对象
+
+        Returns:
+            协程的返回值
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._get_event_loop()).result()
+
+    def _get_file_pool(self):
+        """获取文件级并行处理线程池，首次调用时创建（线程安全）"""
+        if self._file_pool is None:
+            with self._runtime_lock:
+                if self._file_pool is None:
+                    self._file_pool = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix="qa-file")
+        return self._file_pool
+
+    def close(self):
+        """关闭共用的事件循环、异步客户端、线程池、请求合并线程、公式识别线程和答案缓存"""
+        with self._runtime_lock:
+            if self._loop is not None:
+                asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._loop_thread.join()
+                self._loop.close()
+                self._loop = self._loop_thread = self._session = None
+            if self._file_pool is not None:
+                self._file_pool.shutdown(wait=True)
+                self._file_pool = None
+        self.llm_client.close()
+        self.pdf_processor.close()
+        if self.answer_cache is not None:
+            self.answer_cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def _generate_questions(self, content, num_questions, metadata=None):
         """
         生成问题列表
@@ -64,12 +166,8 @@ class QAGenerator:
         logger.info(f"开始生成 {num_questions} 个问题")
 
         # 准备问题生成的提示词
-        div_num_q = int(len(content) / 2000)
-        # 如果按每2000字一个问题分出的问题数小于num_questions，则将num_questions设置为div_num_q
-        if div_num_q < num_questions:
-            num_questions = max(div_num_q, 1)
-            logger.warning(
-                f"按每2000字一个问题分出的问题数小于num_questions，将num_questions设置为{num_questions}")
+        # 按每2000字一个问题限制问题数（过短的文档已在_process_document中跳过，至少为1）
+        num_questions = min(num_questions, len(content) // self.CHARS_PER_QUESTION['pro'])
         prompt = self.prompt_templates.get_pro_question_generation_prompt(
             content, num_questions, metadata)
 
@@ -84,78 +182,198 @@ class QAGenerator:
 
         return questions
 
-    def _generate_answer(self, question, content, metadata=None):
+    def _get_cached_answer(self, question, prepared, scope):
         """
-        为单个问题生成答案
+        查询答案缓存，键为该问题的完整单题提示词
 
         Args:
             question (str): 问题
-            content (str): PDF内容
-            metadata (dict): PDF元数据
+            prepared (PreparedPrompt): 同一文档共用的预生成提示词
+            scope (str): 文档作用域
 
         Returns:
-            str: 生成的答案
+            str: 缓存的答案，未启用缓存或未命中时返回None
         """
-        import time
-        start_time = time.time()
+        if self.answer_cache is None:
+            return None
+        return self.answer_cache.get(prepared.render(question), question, scope)
+
+    def _put_cached_answer(self, question, prepared, scope, answer):
+        """写入答案缓存（批量生成的答案同样按单题提示词为键保存）"""
+        if self.answer_cache is not None and answer:
+            self.answer_cache.put(prepared.render(question), answer, question, scope)
+
+    async def _aget_cached_answer(self, question, prepared, scope):
+        """异步查询答案缓存：数据库和向量检索在线程中执行，不阻塞所有文档共用的事件循环"""
+        if self.answer_cache is None:
+            return None
+        return await asyncio.to_thread(self._get_cached_answer, question, prepared, scope)
+
+    async def _aput_cached_answer(self, question, prepared, scope, answer):
+        """异步写入答案缓存"""
+        if self.answer_cache is not None and answer:
+            await asyncio.to_thread(self._put_cached_answer, question, prepared, scope, answer)
+
+    async def _afor_questions(self, prepared, questions):
+        """异步获取回答给定问题时实际使用的提示词：分块检索在线程中执行，不阻塞共用的事件循环"""
+        if isinstance(prepared, RetrievalPreparedPrompt):
+            return await asyncio.to_thread(prepared.for_questions, questions)
+        return prepared.for_questions(questions)
+
+    async def _agenerate_answer(self, session, question, prepared, scope=None):
+        """
+        为单个问题生成答案（异步），命中缓存时不调用API
 
-        # logger.info(f"开始生成问题的答案: {question[:50]}...")
+        Args:
+            session (AsyncOpenAI): 异步客户端
+            question (str): 问题
+            prepared (PreparedPrompt): 同一文档共用的预生成提示词
+            scope (str): 文档作用域（答案缓存用）
 
-        # 准备答案生成的提示词
-        prompt = self.prompt_templates.get_pro_answer_generation_prompt(
-            question, content, metadata)
+        Returns:
+            str: 生成的答案
+        """
+        cached = await self._aget_cached_answer(question, prepared, scope)
+        if cached is not None:
+            return cached
 
-        # 调用API生成答案
-        answer = self.llm_client.generate_single_answer(prompt)
+        start_time = time.time()
+
+        # 准备答案生成的提示词：只在发送前拼接问题，文档内容部分各问题共用
+        target = await self._afor_questions(prepared, [question])
+        prompt = target.render(question)
 
-        elapsed_time = time.time() - start_time
+        # 调用API生成答案（问题位于提示词末尾，前缀可命中服务端的提示词缓存）
+        answer = await self.llm_client.agenerate_single_answer(
+            session, prompt, cache_prefix=target.prefix)
 
         if answer:
-            # logger.info(
-            #     f"成功生成答案，长度: {len(answer)} 字符，耗时: {elapsed_time:.2f} 秒")
-            pass
+            await self._aput_cached_answer(question, prepared, scope, answer)
         else:
-            logger.warning(f"答案生成失败，耗时: {elapsed_time:.2f} 秒")
+            logger.warning(f"答案生成失败，耗时: {time.time() - start_time:.2f} 秒")
 
         return answer
 
-    def _is_pdf_processed(self, pdf_filename):
+    async def _agenerate_answers_batch(self, session, questions, prepared):
         """
-        检查PDF文件是否已经处理过（通过检查输出目录中是否存在对应的JSON文件）
+        在一次请求中为多个问题生成答案，文档内容只发送一次（异步）
 
         Args:
-            pdf_filename (str): PDF文件名（带扩展名）
+            session (AsyncOpenAI): 异步客户端
+            questions (list): 问题列表
+            prepared (PreparedPrompt): 同一文档共用的预生成提示词
 
         Returns:
-            bool: 如果已处理过返回True，否则返回False
+            list: 与问题一一对应的答案列表，缺失的答案为空字符串
         """
-        # 如果没有excel_writer，无法检查，返回False
-        if not self.excel_writer:
-            return False
+        target = await self._afor_questions(prepared, questions)
+        return await self.llm_client.agenerate_answers_batch(
+            session, target.render_batch(questions), len(questions),
+            cache_prefix=target.document_prefix)
 
-        output_dir = self.excel_writer.output_dir
+    def _prepare_answer_prompt(self, content, metadata=None):
+        """
+        为文档预先生成答案提示词；开启分块检索且文档足够长时，
+        每个问题只使用检索出的相关文本块作为上下文
+
+        Args:
+            content (str): PDF内容
+            metadata (dict): PDF元数据
 
-        # 检查输出目录是否存在
-        if not os.path.exists(output_dir):
-            return False
+        Returns:
+            PreparedPrompt | RetrievalPreparedPrompt: 预生成的提示词
+        """
+        if self.answer_context_chunks > 0:
+            retriever = ChunkRetriever.from_content(content)
+            if retriever is not None and len(retriever.chunks) > self.answer_context_chunks:
+                logger.info(
+                    f"文档切分为 {len(retriever.chunks)} 块，每个问题检索 {self.answer_context_chunks} 块作为答案上下文")
+                return RetrievalPreparedPrompt(retriever, metadata, self.answer_context_chunks)
+        return self.prompt_templates.prepare_pro_answer_prompt(content, metadata)
+
+    async def _aanswer_questions(self, questions, prepared, scope=None):
+        """
+        并发生成所有问题的答案，同时进行中的请求数不超过answer_max_workers
 
-        # 遍历输出目录中的所有JSON文件
-        json_files = glob.glob(os.path.join(output_dir, self.mode, "*.json"))
+        Args:
+            questions (list): 问题列表
+            prepared (PreparedPrompt): 同一文档共用的预生成提示词
+            scope (str): 文档作用域（答案缓存用）
 
-        for json_file in json_files:
+        Returns:
+            list: 与问题顺序一致的(问题, 答案, 异常)元组列表
+        """
+        semaphore = asyncio.Semaphore(self.answer_max_workers)
+
+        # 所有文档共用同一个异步客户端及其连接池
+        session = self._session
+
+        async def answer_question(question):
+            """生成单个问题的答案，异常转为错误信息，不中断其余问题"""
             try:
-                with open(json_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    # 检查source字段是否匹配当前PDF文件名
-                    if 'source' in data and data['source'] == pdf_filename:
-                        logger.info(f"PDF文件 {pdf_filename} 已处理过（找到已存在的JSON文件: {os.path.basename(json_file)}）")
-                        return True
+                async with semaphore:
+                    answer = await self._agenerate_answer(
+                        session, question, prepared, scope)
+                return question, answer, None
             except Exception as e:
-                # 如果读取JSON文件失败，继续检查下一个文件
-                logger.debug(f"读取JSON文件 {json_file} 时出错: {e}")
-                continue
+                return question, None, e
+
+        async def answer_batch(batch):
+            """一次请求生成一批问题的答案，批量结果中缺失的答案逐个重新生成"""
+            if len(batch) == 1:
+                return [await answer_question(batch[0])]
+
+            # 已缓存的问题不再参与批量请求
+            answers = [await self._aget_cached_answer(question, prepared, scope)
+                       for question in batch]
+            pending = [i for i, answer in enumerate(answers) if answer is None]
+            if len(pending) > 1:
+                try:
+                    async with semaphore:
+                        generated = await self._agenerate_answers_batch(
+                            session, [batch[i] for i in pending], prepared)
+                except Exception as e:
+                    logger.error(f"批量生成答案时出现异常，改为逐个生成: {str(e)}")
+                    generated = [""] * len(pending)
+                for i, answer in zip(pending, generated):
+                    answers[i] = answer
+                    await self._aput_cached_answer(batch[i], prepared, scope, answer)
+
+            results = [(question, answer, None) if answer else None
+                       for question, answer in zip(batch, answers)]
+            retry = [i for i, result in enumerate(results) if result is None]
+            retried = await asyncio.gather(*(answer_question(batch[i]) for i in retry))
+            for i, result in zip(retry, retried):
+                results[i] = result
+            return results
+
+        batch_size = self.answer_batch_size
+        batches = [questions[i:i + batch_size]
+                   for i in range(0, len(questions), batch_size)]
+        batch_results = await asyncio.gather(*(answer_batch(batch) for batch in batches))
+
+        return [result for results in batch_results for result in results]
+
+    def _load_processed_sources(self):
+        """
+        一次性获取已处理过的源文件名集合（输出索引 + 单次目录扫描确认输出文件仍存在）
+
+        Returns:
+            set: 已处理的源文件名集合
+        """
+        if not self.excel_writer:
+            return set()
 
-        return False
+        mode_dir = os.path.join(self.excel_writer.output_dir, self.mode)
+        if not os.path.isdir(mode_dir):
+            return set()
+
+        index = self.excel_writer.get_processed_index(self.mode)
+        with os.scandir(mode_dir) as it:
+            existing = {entry.name for entry in it if entry.name.endswith(('.json', '.jsonl'))}
+
+        return {source for source, path in index.items()
+                if os.path.basename(path) in existing}
 
     def _process_document(self, content, filename, metadata=None):
         """
@@ -167,9 +385,16 @@ class QAGenerator:
             metadata (dict): 文档元数据
             
         Returns:
-            tuple: (问答对列表, 文件名, 原始内容, 元数据, 是否成功)
+            tuple: (问答对列表, 文件名, 原始内容, 元数据, 是否成功)，文档过短被跳过时是否成功为None
         """
         try:
+            # 文档过短、连一个问题都分不出时直接跳过，避免无效的API调用；跳过不算处理失败
+            min_chars = self.CHARS_PER_QUESTION.get(self.mode)
+            if min_chars and len(content) < min_chars:
+                logger.info(
+                    f"文件 {filename} 内容过短（{len(content)} 字符，少于 {min_chars} 字符），跳过问答生成")
+                return [], filename, content, metadata, None
+
             # 根据mode选择不同的处理方式
             if self.mode == 'pro':
                 qa_pairs, success = self._process_document_pro(content, filename, metadata)
@@ -191,6 +416,36 @@ class QAGenerator:
             logger.error(f"处理文档 {filename} 时出错: {str(e)}", exc_info=True)
             return [], filename, content, metadata, False
 
+    def _group_duplicate_questions(self, questions):
+        """
+        为每个问题找出同组的代表问题：完全相同的问题（忽略首尾空白和大小写）归为一组，
+        启用语义缓存时再把语义高度相似的问题归为一组
+
+        Args:
+            questions (list): 问题列表
+
+        Returns:
+            list: 与问题一一对应的代表问题下标
+        """
+        first_index = {}
+        representative = [first_index.setdefault(question.strip().lower(), i)
+                          for i, question in enumerate(questions)]
+
+        if self.answer_cache is None:
+            return representative
+        unique_indexes = sorted(set(representative))
+        try:
+            clusters = self.answer_cache.cluster_questions(
+                [questions[i] for i in unique_indexes])
+        except Exception as e:
+            logger.warning(f"问题语义聚类失败，仅合并完全相同的问题: {str(e)}")
+            clusters = None
+        if clusters is None:
+            return representative
+
+        merged = {i: unique_indexes[c] for i, c in zip(unique_indexes, clusters)}
+        return [merged[r] for r in representative]
+
     def _process_document_pro(self, content, filename, metadata=None):
         """
         Pro模式文档处理：先生成问题集，然后逐个生成答案
@@ -215,36 +470,44 @@ class QAGenerator:
 
             logger.info(f"[第2步] 成功生成 {len(questions)} 个问题")
 
-            # 第三步：使用线程池并行生成答案
-            logger.info(f"[第3步] 使用 {self.answer_max_workers} 个线程并行生成答案")
+            # 第三步：异步并发生成答案（I/O密集，无需为每个请求占用一个线程）
+            logger.info(
+                f"[第3步] 以最多 {self.answer_max_workers} 个并发请求生成答案，每批 {self.answer_batch_size} 个问题")
             qa_pairs = []
             failed_count = 0
 
-            with ThreadPoolExecutor(max_workers=self.answer_max_workers) as executor:
-                # 提交所有答案生成任务
-                future_to_question = {
-                    executor.submit(self._generate_answer, q, content, metadata): q
-                    for q in questions
-                }
-
-                # 收集结果
-                for future in as_completed(future_to_question):
-                    question = future_to_question[future]
-                    try:
-                        answer = future.result()
-                        if answer:
-                            qa_pairs.append({
-                                "question": question,
-                                "answer": answer
-                            })
-                        else:
-                            failed_count += 1
-                            logger.warning(
-                                f"问题答案生成失败（空答案）: {question[:50]}...")
-                    except Exception as e:
-                        failed_count += 1
-                        logger.error(
-                            f"生成问题答案时出现异常: {question[:50]}..., 错误: {str(e)}")
+            # 包含文档内容的提示词只生成一次，各问题及各批次共用
+            prepared = self._prepare_answer_prompt(content, metadata)
+            scope = content_scope(content) if self.answer_cache is not None else None
+
+            # 重复和近似重复的问题只请求一次，答案再分配给同组的各个问题
+            representative = self._group_duplicate_questions(questions)
+            unique_indexes = sorted(set(representative))
+            if len(unique_indexes) < len(questions):
+                logger.info(
+                    f"[第3步] 合并 {len(questions) - len(unique_indexes)} 个重复或近似重复的问题后生成答案")
+
+            # 结果顺序与问题顺序一致
+            unique_results = self._run_async(self._aanswer_questions(
+                [questions[i] for i in unique_indexes], prepared, scope))
+            answer_by_index = {i: (answer, error)
+                               for i, (_, answer, error) in zip(unique_indexes, unique_results)}
+            results = [(question, *answer_by_index[representative[i]])
+                       for i, question in enumerate(questions)]
+            for question, answer, error in results:
+                if error is not None:
+                    failed_count += 1
+                    logger.error(
+                        f"生成问题答案时出现异常: {question[:50]}..., 错误: {str(error)}")
+                elif answer:
+                    qa_pairs.append({
+                        "question": question,
+                        "answer": answer
+                    })
+                else:
+                    failed_count += 1
+                    logger.warning(
+                        f"问题答案生成失败（空答案）: {question[:50]}...")
 
             logger.info(
                 f"[第3步] 答案生成完成，成功: {len(qa_pairs)}, 失败: {failed_count}")
@@ -273,30 +536,18 @@ class QAGenerator:
         """
         try:
             # 计算问题数量限制（类似pro模式）
-            num_questions = self.num_qa_pairs
-            div_num_q = int(len(content) / 800)
-            if div_num_q < num_questions:
-                num_questions = max(div_num_q, 1)
-                logger.warning(
-                    f"按每800字一个问题分出的问题数小于num_qa_pairs，将num_questions设置为{num_questions}")
+            # 按每800字一个问题限制问题数（过短的文档已在_process_document中跳过，至少为1）
+            num_questions = min(self.num_qa_pairs,
+                                len(content) // self.CHARS_PER_QUESTION['normal'])
 
             # 生成prompt
             logger.info(f"[Normal模式] 一次性生成 {num_questions} 个问答对")
             prompt = self.prompt_templates.get_normal_qa_pair_generation_prompt(
                 content, num_questions, metadata)
 
-            # 调用API一次性生成所有问答对
-            qa_pairs = self.llm_client.generate_qa_pairs(prompt, num_questions)
-
-            if not qa_pairs:
-                logger.warning(f"文件 {filename} 生成问答对失败")
-                return [], False
-
-            logger.info(f"[Normal模式] 成功生成 {len(qa_pairs)} 个问答对")
-
-            # 验证问答对格式
+            # 流式调用API，边生成边逐个验证问答对格式，响应中途中断时已收到的问答对仍可使用
             valid_qa_pairs = []
-            for qa in qa_pairs:
+            for qa in self.llm_client.stream_qa_pairs(prompt, num_questions):
                 if isinstance(qa, dict) and 'question' in qa and 'answer' in qa:
                     valid_qa_pairs.append({
                         "question": qa['question'],
@@ -325,18 +576,25 @@ class QAGenerator:
             filename (str): 文件名
             metadata (dict): 文档元数据
         """
-        # 计算统计信息
-        total_answer_length = sum(len(qa['answer']) for qa in qa_pairs)
+        # 计算统计信息（一次遍历得到总长度、最短和最长答案）
+        total_answer_length = 0
+        min_answer_length = None
+        max_answer_length = 0
+        for qa in qa_pairs:
+            length = len(qa['answer'])
+            total_answer_length += length
+            if min_answer_length is None or length < min_answer_length:
+                min_answer_length = length
+            if length > max_answer_length:
+                max_answer_length = length
         avg_answer_length = total_answer_length / len(qa_pairs) if qa_pairs else 0
 
         logger.info(f"========== 文件 {filename} 处理完成 ==========")
         logger.info(f"统计信息:")
         logger.info(f"  - 成功生成问答对: {len(qa_pairs)} 个")
         logger.info(f"  - 平均答案长度: {avg_answer_length:.0f} 字符")
-        logger.info(
-            f"  - 最短答案: {min(len(qa['answer']) for qa in qa_pairs)} 字符")
-        logger.info(
-            f"  - 最长答案: {max(len(qa['answer']) for qa in qa_pairs)} 字符")
+        logger.info(f"  - 最短答案: {min_answer_length} 字符")
+        logger.info(f"  - 最长答案: {max_answer_length} 字符")
 
         # 立即保存到单独的JSON文件
         if self.excel_writer:
@@ -345,15 +603,17 @@ class QAGenerator:
             if saved_path:
                 logger.info(f"已保存到文件: {saved_path}")
 
-    def process_pdf(self, pdf_path):
+    def process_pdf(self, pdf_path, layout=None):
         """
         处理单个PDF文件（两阶段生成：先生成问题，再并行生成答案）
 
         Args:
             pdf_path (str): PDF文件路径
+            layout (tuple): 已在子进程中提取好的版面（PDFProcessor.iter_layouts的产出），
+                            为None时在当前线程中提取
 
         Returns:
-            tuple: (问答对列表, 源文件名, 原始内容, 元数据, 是否成功)
+            tuple: (问答对列表, 源文件名, 原始内容, 元数据, 是否成功)，文档过短被跳过时是否成功为None
         """
         filename = os.path.basename(pdf_path)
         try:
@@ -361,8 +621,12 @@ class QAGenerator:
 
             # 第一步：从PDF提取文本
             logger.info(f"[第1步] 从PDF提取文本")
-            content, filename, metadata = self.pdf_processor.extract_text_from_pdf(
-                pdf_path)
+            if layout is None:
+                content, filename, metadata = self.pdf_processor.extract_text_from_pdf(
+                    pdf_path)
+            else:
+                metadata = layout[0]
+                content = self.pdf_processor._build_text(filename, layout)
 
             if not content:
                 logger.warning(f"PDF文件 {filename} 没有提取到内容")
@@ -392,13 +656,14 @@ class QAGenerator:
             logger.warning("没有找到PDF文件")
             return [], []
 
-        # 过滤掉已经处理过的PDF文件
+        # 过滤掉已经处理过的PDF文件（已处理集合只加载一次）
+        processed = self._load_processed_sources()
         pdf_files_to_process = []
         skipped_files = []
-        
+
         for pdf_file in pdf_files:
             pdf_filename = os.path.basename(pdf_file)
-            if self._is_pdf_processed(pdf_filename):
+            if pdf_filename in processed:
                 skipped_files.append(pdf_filename)
             else:
                 pdf_files_to_process.append(pdf_file)
@@ -414,32 +679,52 @@ class QAGenerator:
 
         results = []
         self.failed_files = []  # 重置失败文件列表
+        short_files = []  # 内容过短而跳过的文件，不计入失败
 
         logger.info(f"开始处理 {len(pdf_files_to_process)} 个PDF文件（共 {len(pdf_files)} 个，跳过 {len(skipped_files)} 个）")
 
-        # 使用线程池并行处理PDF文件
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # 提交所有任务
-            future_to_pdf = {executor.submit(
-                self.process_pdf, pdf): pdf for pdf in pdf_files_to_process}
-
-            # 收集结果
-            for future in as_completed(future_to_pdf):
-                pdf = future_to_pdf[future]
-                pdf_name = os.path.basename(pdf)
-                try:
-                    qa_pairs, filename, content, metadata, success = future.result()
+        # 版面提取是CPU密集型，由进程池完成；公式识别和LLM调用在消费线程中进行。
+        # 两者之间用有界队列衔接，消费跟不上时生产端阻塞，峰值内存有界
+        work_queue = queue.Queue(maxsize=self.max_workers * 2)
+        results_lock = threading.Lock()
+
+        def consume():
+            while True:
+                item = work_queue.get()
+                if item is None:
+                    break
+                pdf, layout = item
+                if layout is None:
+                    with results_lock:
+                        self.failed_files.append(os.path.basename(pdf))
+                    continue
+                qa_pairs, filename, content, metadata, success = self.process_pdf(pdf, layout)
+                with results_lock:
                     if success:
                         results.append((qa_pairs, filename, content, metadata))
+                    elif success is None:
+                        short_files.append(filename)
                     else:
                         self.failed_files.append(filename)
-                except Exception as e:
-                    logger.error(f"获取文件 {pdf} 的处理结果时出错: {str(e)}")
-                    self.failed_files.append(pdf_name)
+
+        consumers = [threading.Thread(target=consume, name=f"qa-consumer-{i}", daemon=True)
+                     for i in range(self.max_workers)]
+        for consumer in consumers:
+            consumer.start()
+
+        try:
+            for item in self.pdf_processor.iter_layouts(pdf_files_to_process, self.max_workers):
+                work_queue.put(item)
+        finally:
+            for _ in consumers:
+                work_queue.put(None)
+            for consumer in consumers:
+                consumer.join()
 
         logger.info(
             f"处理完成：共 {len(pdf_files)} 个PDF文件，跳过 {len(skipped_files)} 个已处理的文件，"
-            f"实际处理 {len(pdf_files_to_process)} 个，成功: {len(results)}，失败: {len(self.failed_files)}")
+            f"实际处理 {len(pdf_files_to_process)} 个，成功: {len(results)}，"
+            f"内容过短跳过: {len(short_files)}，失败: {len(self.failed_files)}")
 
         # 打印处理失败的文件列表
         if self.failed_files:
@@ -462,25 +747,31 @@ class QAGenerator:
                   失败文件列表: 处理失败的文件名列表
         """
         
-        # 获取所有txt文件
-        txt_files = glob.glob(os.path.join(txt_dir, "*.txt"))
+        # 获取所有txt文件（单次目录扫描）
+        txt_files = []
+        if os.path.isdir(txt_dir):
+            with os.scandir(txt_dir) as it:
+                txt_files = [entry.path for entry in it
+                             if entry.name.endswith('.txt') and not entry.name.startswith('.')
+                             and entry.is_file()]
         
         if not txt_files:
             logger.warning(f"在目录 {txt_dir} 中没有找到txt文件")
             return [], []
         
-        # 过滤掉已经处理过的txt文件
+        # 过滤掉已经处理过的txt文件（已处理集合只加载一次）
+        processed = self._load_processed_sources()
         txt_files_to_process = []
         skipped_files = []
-        
+
         for txt_file in txt_files:
             txt_filename = os.path.basename(txt_file)
             # 从文件名推断原始PDF文件名（去除.txt扩展名，添加.pdf）
             pdf_filename = os.path.splitext(txt_filename)[0] + '.pdf'
-            if self._is_pdf_processed(pdf_filename):
+            if pdf_filename in processed:
                 skipped_files.append(txt_filename)
             else:
-                txt_files_to_process.append(txt_file)
+                txt_files_to_process.append((txt_file, pdf_filename))
         
         if skipped_files:
             logger.info(f"跳过 {len(skipped_files)} 个已处理的txt文件:")
@@ -495,12 +786,11 @@ class QAGenerator:
         
         results = []
         self.failed_files = []  # 重置失败文件列表
+        short_files = []  # 内容过短而跳过的文件，不计入失败
         
-        def process_single_txt(txt_path):
+        def process_single_txt(txt_path, pdf_filename):
             """处理单个txt文件"""
             txt_filename = os.path.basename(txt_path)
-            # 从文件名推断原始PDF文件名（去除.txt扩展名，添加.pdf）
-            pdf_filename = os.path.splitext(txt_filename)[0] + '.pdf'
             
             try:
                 logger.info(f"========== 开始处理txt文件: {txt_filename} ==========")
@@ -522,31 +812,34 @@ class QAGenerator:
                 logger.error(f"处理txt文件 {txt_path} 时出错: {str(e)}", exc_info=True)
                 return [], pdf_filename, "", {}, False
         
-        # 使用线程池并行处理txt文件
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # 提交所有任务
-            future_to_txt = {
-                executor.submit(process_single_txt, txt): txt 
-                for txt in txt_files_to_process
-            }
-            
-            # 收集结果
-            for future in as_completed(future_to_txt):
-                txt = future_to_txt[future]
-                txt_name = os.path.basename(txt)
-                try:
-                    qa_pairs, filename, content, metadata, success = future.result()
-                    if success:
-                        results.append((qa_pairs, filename, content, metadata))
-                    else:
-                        self.failed_files.append(filename)
-                except Exception as e:
-                    logger.error(f"获取文件 {txt} 的处理结果时出错: {str(e)}")
-                    self.failed_files.append(txt_name)
+        # 使用共用的线程池并行处理txt文件
+        executor = self._get_file_pool()
+        # 提交所有任务
+        future_to_txt = {
+            executor.submit(process_single_txt, txt, pdf_filename): txt
+            for txt, pdf_filename in txt_files_to_process
+        }
+
+        # 收集结果
+        for future in as_completed(future_to_txt):
+            txt = future_to_txt[future]
+            txt_name = os.path.basename(txt)
+            try:
+                qa_pairs, filename, content, metadata, success = future.result()
+                if success:
+                    results.append((qa_pairs, filename, content, metadata))
+                elif success is None:
+                    short_files.append(filename)
+                else:
+                    self.failed_files.append(filename)
+            except Exception as e:
+                logger.error(f"获取文件 {txt} 的处理结果时出错: {str(e)}")
+                self.failed_files.append(txt_name)
         
         logger.info(
             f"处理完成：共 {len(txt_files)} 个txt文件，跳过 {len(skipped_files)} 个已处理的文件，"
-            f"实际处理 {len(txt_files_to_process)} 个，成功: {len(results)}，失败: {len(self.failed_files)}")
+            f"实际处理 {len(txt_files_to_process)} 个，成功: {len(results)}，"
+            f"内容过短跳过: {len(short_files)}，失败: {len(self.failed_files)}")
         
         # 打印处理失败的文件列表
         if self.failed_files:
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+长文档分块检索
+将文档按段落切分为带重叠的块，用TF-IDF（字符一元、二元组，适用于中英文混排）
+为每个问题选出最相关的若干块作为答案生成的上下文，依赖scikit-learn，未安装时不可用
+"""
+
+import logging
+
+try:
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics.pairwise import linear_kernel
+except ImportError:
+    TfidfVectorizer = None
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def chunk_by_paragraphs(content, target=3000, overlap=200):
+    """
+    按段落把文档切分为长度约为target字符的块，相邻块之间保留overlap字符的重叠
+
+    Args:
+        content (str): 文档内容
+        target (int): 每块的目标字符数
+        overlap (int): 相邻块的重叠字符数
+
+    Returns:
+        list: 文本块列表（按文档顺序）
+    """
+    paragraphs = [p for p in content.split('\n') if p.strip()]
+    chunks = []
+    current = ''
+    # 重叠只在换块时通过携带上一块的末尾实现；超长段落的硬切分片段互不重叠，
+    # 且留出携带部分和换行符的长度，保证携带末尾后的新块也不超过target
+    piece_size = max(1, target - overlap - 1)
+
+    for paragraph in paragraphs:
+        pieces = [paragraph[i:i + piece_size]
+                  for i in range(0, len(paragraph), piece_size)]
+        for piece in pieces:
+            if current and len(current) + len(piece) + 1 > target:
+                chunks.append(current)
+                current = current[-overlap:] if overlap else ''
+            current = f"{current}\n{piece}" if current else piece
+
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class ChunkRetriever:
+    """基于TF-IDF余弦相似度的文档块检索器，每个文档构建一次"""
+
+    def __init__(self, chunks):
+        """
+        Args:
+            chunks (list): 文本块列表（按文档顺序）
+        """
+        self.chunks = chunks
+        self._vectorizer = TfidfVectorizer(analyzer='char', ngram_range=(1, 2),
+                                           sublinear_tf=True)
+        self._chunk_vecs = self._vectorizer.fit_transform(chunks)
+
+    @classmethod
+    def from_content(cls, content, target=3000, overlap=200):
+        """
+        切分文档并构建检索器
+
+        Args:
+            content (str): 文档内容
+            target (int): 每块的目标字符数
+            overlap (int): 相邻块的重叠字符数
+
+        Returns:
+            ChunkRetriever: 检索器，未安装scikit-learn时返回None
+        """
+        if TfidfVectorizer is None:
+            logger.warning("未安装scikit-learn，答案生成将使用完整文档作为上下文")
+            return None
+        return cls(chunk_by_paragraphs(content, target, overlap))
+
+    def top_chunks(self, questions, top_k=3):
+        """
+        为一组问题选出最相关的文本块，多个问题时取各自top_k的并集
+
+        Args:
+            questions (list): 问题列表
+            top_k (int): 每个问题选取的块数
+
+        Returns:
+            list: 选中的文本块（按文档顺序）
+        """
+        # TF-IDF向量已L2归一化，线性核即余弦相似度
+        scores = linear_kernel(self._vectorizer.transform(questions), self._chunk_vecs)
+        selected = set()
+        for row in scores:
+            selected.update(row.argsort()[::-1][:top_k].tolist())
+        return [self.chunks[i] for i in sorted(selected)]
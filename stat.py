@@ -7,19 +7,51 @@
 
 import os
 import json
-import glob
-from collections import Counter, defaultdict
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import argparse
 
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 def load_json_files(output_dir):
     """加载所有JSON文件"""
-    json_files = glob.glob(os.path.join(output_dir, "*.json"))
-    return json_files
+    # 单次目录扫描；排除输出索引文件（_index.json），它不是问答结果
+    with os.scandir(output_dir) as it:
+        return [entry.path for entry in it
+                if entry.name.endswith('.json') and not entry.name.startswith('.')
+                and entry.name != "_index.json" and entry.is_file()]
+
+
+def read_json_file(json_file):
+    """
+    读取单个JSON文件并提取问题、答案长度
+
+    Returns:
+        tuple: (源文件名, 问题长度数组, 答案长度数组, 问答对数)
+    """
+    with open(json_file, 'rb') as f:
+        raw = f.read()
+    data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+    qa_pairs = data.get('qa_pairs')
+    if not isinstance(qa_pairs, list):
+        qa_pairs = []
 
+    question_lengths = np.fromiter(
+        (len(qa['question']) for qa in qa_pairs if 'question' in qa), dtype=np.int64)
+    answer_lengths = np.fromiter(
+        (len(qa['answer']) for qa in qa_pairs if 'answer' in qa), dtype=np.int64)
+    return data.get('source'), question_lengths, answer_lengths, len(qa_pairs)
 
-def collect_statistics(output_dir):
-    """收集统计信息"""
+
+def collect_statistics(output_dir, max_workers=8):
+    """收集统计信息（多线程并行读取JSON文件）"""
     json_files = load_json_files(output_dir)
     
     if not json_files:
@@ -28,76 +60,75 @@ def collect_statistics(output_dir):
     
     # 统计变量
     documents = set()  # 文档集合（去重）
-    question_lengths = []  # 所有问题的长度
-    answer_lengths = []  # 所有答案的长度
+    question_parts = []  # 各文件的问题长度数组
+    answer_parts = []  # 各文件的答案长度数组
     total_qa_pairs = 0  # 总问答对数
-    
-    # 遍历所有JSON文件
-    for json_file in json_files:
+
+    def read_safely(json_file):
         try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
-                # 统计文档
-                if 'source' in data:
-                    documents.add(data['source'])
-                
-                # 统计问答对
-                if 'qa_pairs' in data and isinstance(data['qa_pairs'], list):
-                    for qa_pair in data['qa_pairs']:
-                        if 'question' in qa_pair:
-                            question_lengths.append(len(qa_pair['question']))
-                        if 'answer' in qa_pair:
-                            answer_lengths.append(len(qa_pair['answer']))
-                        total_qa_pairs += 1
-                        
+            return read_json_file(json_file)
         except Exception as e:
             print(f"警告: 读取文件 {json_file} 时出错: {e}")
-            continue
-    
+            return None
+
+    # 文件读取和解码在线程池中并行进行，结果按文件顺序汇总
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for result in executor.map(read_safely, json_files):
+            if result is None:
+                continue
+            source, question_lengths, answer_lengths, count = result
+            if source is not None:
+                documents.add(source)
+            question_parts.append(question_lengths)
+            answer_parts.append(answer_lengths)
+            total_qa_pairs += count
+
+    empty = np.empty(0, dtype=np.int64)
     return {
         'documents': documents,
-        'question_lengths': question_lengths,
-        'answer_lengths': answer_lengths,
+        'question_lengths': np.concatenate(question_parts) if question_parts else empty,
+        'answer_lengths': np.concatenate(answer_parts) if answer_parts else empty,
         'total_qa_pairs': total_qa_pairs,
         'total_files': len(json_files)
     }
 
 
+# 长度区间的右边界（含），超过最后一个边界的归入最后一个区间
+BIN_EDGES = np.array([50, 100, 200, 500, 1000, 2000], dtype=np.int64)
+BIN_LABELS = ['0-50', '51-100', '101-200', '201-500', '501-1000', '1001-2000', '2000+']
+
+
 def calculate_distribution(lengths):
     """计算长度分布统计"""
-    if not lengths:
+    if lengths is None or len(lengths) == 0:
         return None
-    
-    lengths_sorted = sorted(lengths)
-    n = len(lengths)
-    
+
+    a = np.asarray(lengths, dtype=np.int64)
+    n = a.size
+
+    # 只对需要的几个位置做部分排序（O(n)），分位数取法与原先的排序下标一致
+    kth = sorted({0, n - 1, (n - 1) // 2, n // 2, n // 4, 3 * n // 4})
+    part = np.partition(a, kth)
+
     stats = {
         'count': n,
-        'min': lengths_sorted[0],
-        'max': lengths_sorted[-1],
-        'mean': sum(lengths) / n,
-        'median': lengths_sorted[n // 2] if n % 2 == 1 else (lengths_sorted[n // 2 - 1] + lengths_sorted[n // 2]) / 2,
-        'p25': lengths_sorted[n // 4] if n >= 4 else lengths_sorted[0],
-        'p75': lengths_sorted[3 * n // 4] if n >= 4 else lengths_sorted[-1],
+        'min': int(part[0]),
+        'max': int(part[n - 1]),
+        'mean': float(a.mean()),
+        'median': int(part[n // 2]) if n % 2 == 1 else (int(part[n // 2 - 1]) + int(part[n // 2])) / 2,
+        'p25': int(part[n // 4]) if n >= 4 else int(part[0]),
+        'p75': int(part[3 * n // 4]) if n >= 4 else int(part[n - 1]),
     }
-    
-    # 计算分区间分布
+
+    # 计算分区间分布（区间右闭：长度 <= 边界）
     if stats['max'] > stats['min']:
-        bins = [0, 50, 100, 200, 500, 1000, 2000, float('inf')]
-        bin_labels = ['0-50', '51-100', '101-200', '201-500', '501-1000', '1001-2000', '2000+']
-        distribution = defaultdict(int)
-        
-        for length in lengths:
-            for i, threshold in enumerate(bins[1:], 0):
-                if length <= threshold:
-                    distribution[bin_labels[i]] += 1
-                    break
-        
-        stats['distribution'] = dict(distribution)
+        counts = np.bincount(np.searchsorted(BIN_EDGES, a, side='left'),
+                             minlength=len(BIN_LABELS))
+        stats['distribution'] = {label: int(count)
+                                 for label, count in zip(BIN_LABELS, counts) if count}
     else:
         stats['distribution'] = {}
-    
+
     return stats
 
 
@@ -155,6 +186,8 @@ def main():
     parser = argparse.ArgumentParser(description='统计问答对的文档数、问题长度分布、答案长度分布')
     parser.add_argument('--output_dir', type=str, default='output/easy',
                         help='输出目录 (默认: output)')
+    parser.add_argument('--read_workers', type=int, default=8,
+                        help='并行读取JSON文件的线程数 (默认: 8)')
     
     args = parser.parse_args()
     
@@ -164,7 +197,7 @@ def main():
         return
     
     # 收集统计信息
-    stats = collect_statistics(args.output_dir)
+    stats = collect_statistics(args.output_dir, max(1, args.read_workers))
     
     if stats is None:
         return